@@ -1,89 +1,87 @@
+import time
+# Cold start is measured from here, so the heavy imports below are included.
+startup_began = time.monotonic()
+import atexit
 import os
-from google.transit import gtfs_realtime_pb2
-from datetime import datetime, date
+import zlib
+from collections import namedtuple
 import dash
 from dash import dcc
 from dash import html
+from dash import Patch
 from dash.dependencies import Input, Output, State
-import plotly.graph_objects as go
-import geopandas as gpd
-import pandas as pd
+import numpy as np
 import dash_bootstrap_components as dbc
-import osmnx as ox
-import geopandas as gpd
-import json
-import requests
-import urllib.request
+import flask
+import metrics
+from archive import SnapshotArchive
+from caches import SizedLRUCache
+from fetch import fetch, fetch_all, set_recorder
+from gtfs_rt import (combine_decoded, decode_if_changed, decode_trip_updates, decode_vehicle_positions,
+                    empty_trip_update_snapshot, format_epochs, has_decoded, join_stop_times, trip_update_snapshot)
+from gbfs import STATUS_COLUMNS, StationFeed
+from gtfs_static import CACHE_DIR, SystemRegistry, load_system
+from metrics import timer
+from map_detail import DEFAULT_ZOOM, DETAIL_LEVELS, detail_level, polyline, quantize, view_bounds, within
+from realtime import SnapshotCache, SnapshotStore
+from replay import FeedReplay, replay_speed
+
+# REPLAY_DIR answers every MTA, OBA and GBFS request from feeds recorded with FEED_RECORD_DIR
+# instead of the network, at REPLAY_SPEED times real time ('max' for as fast as possible).
+feed_replay = None
+if os.environ.get('REPLAY_DIR'):
+    feed_replay = FeedReplay(os.environ['REPLAY_DIR'], replay_speed(os.environ.get('REPLAY_SPEED', '1')))
+    feed_replay.install()
+elif os.environ.get('FEED_RECORD_DIR'):
+    set_recorder(os.environ['FEED_RECORD_DIR'])
+
+def poll_timing(interval, ttl=None):
+    # SnapshotCache.register() timing, scaled to the replay speed when replaying.
+    ttl = interval * 5 if ttl is None else ttl
+    if feed_replay is not None:
+        interval, ttl = feed_replay.poll_timing(interval, ttl)
+    return {'interval': interval, 'ttl': ttl}
 
 subfile = ['bus_bronx','bus_brooklyn','bus_manhattan','bus_queens',
            'bus_staten_island','subway','LIRR','MNR','bus_new_jersy','NJ_rail']
 
-dataframes = {} 
+# Systems are loaded when first selected and evicted least recently used first once they
+# take more than STATIC_MEMORY_BUDGET_MB; STATIC_PRELOAD lists systems to load at startup.
+static_memory_budget = int(os.environ.get('STATIC_MEMORY_BUDGET_MB', '2048')) * 1024 * 1024
+static_preload = [subdir for subdir in os.environ.get('STATIC_PRELOAD', '').split(',') if subdir]
+# Only trips running today are loaded; STATIC_SERVICE_DAYS=2 also keeps tomorrow's.
+static_service_days = int(os.environ.get('STATIC_SERVICE_DAYS', '1'))
 
-for subdir in subfile:
-    folder_path = os.path.join('GTFS', subdir)
+def load_static_system(subdir):
+    system = load_system(subdir, service_days=static_service_days)
+    if subdir == 'bus_new_jersy':
+        system.routes['color'] = '#00FF00'
+    return system
 
-    routes = pd.read_csv(os.path.join(folder_path, 'routes.txt'))
-    stop_times = pd.read_csv(os.path.join(folder_path, 'stop_times.txt'))
-    stops = pd.read_csv(os.path.join(folder_path, 'stops.txt'))
-    trips = pd.read_csv(os.path.join(folder_path, 'trips.txt'))
+static_feeds = SystemRegistry(subfile, static_memory_budget, loader=load_static_system)
+static_feeds.preload(static_preload)
 
-    df = trips[['route_id', 'service_id', 'trip_id']]
-    df = df.merge(stop_times[['trip_id', 'arrival_time', 'departure_time', 'stop_sequence', 'stop_id']],
-                  left_on='trip_id', right_on='trip_id', how='left')
-    df = df.merge(stops[['stop_id', 'stop_name', 'stop_lat', 'stop_lon']],
-                  left_on='stop_id', right_on='stop_id', how='left')
-    df = df.merge(routes[['route_id', 'route_long_name', 'route_color']],
-                  left_on='route_id', right_on='route_id', how='left')
-
-    route_color_mapping = df.set_index('route_id')['route_color'].fillna('000000').astype(str).apply(lambda x: "#" + x).to_dict()
-    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df['stop_lon'], df['stop_lat']))
-    gdf.crs = "EPSG:4326"
-    gdf['color'] = gdf['route_id'].map(route_color_mapping)
-    dataframes[subdir] = gdf
-
-dataframes['bus_new_jersy']['color'] = '#00FF00'
 boroughs = ["Bronx", "Brooklyn", "Manhattan", "Queens", "Staten_Island","New_Jersy"]
 citibike_regions = ['NYC District', 'JC District', 'Hoboken District']
-subway_id = dataframes['subway']['route_id'].unique()
-bus_bronx_id = dataframes['bus_bronx']['route_id'].unique()
-bus_brooklyn_id = dataframes['bus_brooklyn']['route_id'].unique()
-bus_manhattan_id = dataframes['bus_manhattan']['route_id'].unique()
-bus_queens_id = dataframes['bus_queens']['route_id'].unique()
-bus_staten_island_id = dataframes['bus_staten_island']['route_id'].unique()
-bus_new_jersy_id = dataframes['bus_new_jersy']['route_id'].unique()
-LIRR_id = dataframes['LIRR']['route_id'].unique()
-MNR_id = dataframes['MNR']['route_id'].unique()
-NJ_rail_id = dataframes['NJ_rail']['route_id'].unique()
+subway_id = static_feeds.route_ids('subway')
+bus_bronx_id = static_feeds.route_ids('bus_bronx')
+bus_brooklyn_id = static_feeds.route_ids('bus_brooklyn')
+bus_manhattan_id = static_feeds.route_ids('bus_manhattan')
+bus_queens_id = static_feeds.route_ids('bus_queens')
+bus_staten_island_id = static_feeds.route_ids('bus_staten_island')
+bus_new_jersy_id = static_feeds.route_ids('bus_new_jersy')
+LIRR_id = static_feeds.route_ids('LIRR')
+MNR_id = static_feeds.route_ids('MNR')
+NJ_rail_id = static_feeds.route_ids('NJ_rail')
+
+citibike_feed = StationFeed(
+    information_url="https://gbfs.citibikenyc.com/gbfs/en/station_information.json",
+    status_url='https://gbfs.citibikenyc.com/gbfs/en/station_status.json',
+    regions_url='https://gbfs.citibikenyc.com/gbfs/en/system_regions.json',
+)
 
 def citibike_station_data():
-    station_info_url = "https://gbfs.citibikenyc.com/gbfs/en/station_information.json"
-    info_response = urllib.request.urlopen(station_info_url)
-    data_info = json.load(info_response)
-
-    station_status_url = 'https://gbfs.citibikenyc.com/gbfs/en/station_status.json'
-    status_response = urllib.request.urlopen(station_status_url)
-    data_status = json.load(status_response)
-
-    system_regions_url = 'https://gbfs.citibikenyc.com/gbfs/en/system_regions.json'
-    regions_response = urllib.request.urlopen(system_regions_url)
-    data_regions = json.load(regions_response)
-
-    info_df = pd.DataFrame(data_info['data']['stations']).set_index('station_id')
-    info_df = info_df[['name', 'lat', 'lon', 'capacity', 'region_id']]
-
-    status_df = pd.DataFrame(data_status['data']['stations']).set_index('station_id')
-    status_df = status_df[['num_docks_available', 'num_bikes_disabled', 'num_ebikes_available', 'num_bikes_available', 'num_docks_disabled', 'is_renting', 'is_returning', 'last_reported', 'is_installed']]
-
-    regions_df = pd.DataFrame(data_regions['data']['regions'])
-    regions_df.rename(columns={'name': 'region_name'}, inplace=True)
-
-    citibike_df = info_df.merge(status_df, left_index=True, right_index=True)
-    citibike_df = citibike_df.merge(regions_df[['region_id', 'region_name']], left_on='region_id', right_on='region_id')
-    citibike_gdf = gpd.GeoDataFrame(citibike_df,
-                                    geometry=gpd.points_from_xy(citibike_df['lon'], citibike_df['lat']),
-                                    crs="EPSG:4326")
-    return citibike_gdf
+    return citibike_feed.refresh()
 
 with open("GTFS/subway_API_Key.txt", "r") as f:
     subway_API_KEY = f.read().strip()
@@ -103,152 +101,89 @@ def export_subway_schedule(api_key):
         'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si',
     ]
 
-    feed = gtfs_realtime_pb2.FeedMessage()
-
-    for url in urls:
-        response = requests.get(url, headers={'x-api-key': api_key})
-        feed_message = gtfs_realtime_pb2.FeedMessage()
-        feed_message.ParseFromString(response.content)
-        feed.entity.extend(feed_message.entity)
+    results = fetch_all(urls, headers={'x-api-key': api_key}, conditional=[has_decoded(url) for url in urls])
+    # Some feeds failing still leaves the others worth showing; all of them failing is raised
+    # like a single-feed failure, so the last good snapshot is kept and the error reported.
+    if all(result.error is not None for result in results):
+        raise results[0].error
+    frames = [decode_if_changed(result.url, result.content, decode_trip_updates)
+              for result in results if result.error is None]
 
-    subway_schedule = []
-
-    for entity in feed.entity:
-        if entity.HasField('trip_update'):
-            trip_update = entity.trip_update
-            for stop_time_update in trip_update.stop_time_update:
-                arrival_time = datetime.fromtimestamp(stop_time_update.arrival.time).strftime("%Y-%m-%d %H:%M:%S")
-                departure_time = datetime.fromtimestamp(stop_time_update.departure.time).strftime("%Y-%m-%d %H:%M:%S")
-                stop_id = stop_time_update.stop_id
-                subway_schedule.append({
-                    'route': trip_update.trip.route_id,
-                    'arrival_time': arrival_time,
-                    'departure_time': departure_time,
-                    'stop_id': stop_id
-                })
-
-    return subway_schedule
-
-subway_schedule = export_subway_schedule(subway_API_KEY)
+    return combine_decoded('subway', [frame for frame in frames if frame is not None])
 
 def export_MNR_schedule(api_key):
     url = 'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/mnr%2Fgtfs-mnr'
-    feed = gtfs_realtime_pb2.FeedMessage()
-    response = requests.get(url, headers={'x-api-key': api_key})
-    feed_message = gtfs_realtime_pb2.FeedMessage()
-    feed_message.ParseFromString(response.content)
-    feed.entity.extend(feed_message.entity)
-
-    MNR_schedule = []
-
-    for entity in feed.entity:
-        if entity.HasField('trip_update'):
-            trip_update = entity.trip_update
-            for stop_time_update in trip_update.stop_time_update:
-                arrival_time = datetime.fromtimestamp(stop_time_update.arrival.time).strftime("%Y-%m-%d %H:%M:%S")
-                departure_time = datetime.fromtimestamp(stop_time_update.departure.time).strftime("%Y-%m-%d %H:%M:%S")
-                stop_id = stop_time_update.stop_id
-                MNR_schedule.append({
-                    'route': trip_update.trip.route_id,
-                    'arrival_time': arrival_time,
-                    'departure_time': departure_time,
-                    'stop_id': stop_id
-                })
-
-    return MNR_schedule
-
-MNR_schedule = export_MNR_schedule(subway_API_KEY)
+    content = fetch(url, headers={'x-api-key': api_key}, conditional=has_decoded(url))
+    return decode_if_changed(url, content, decode_trip_updates)
 
 def export_LIRR_schedule(api_key):
     url = 'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/lirr%2Fgtfs-lirr'
-    feed = gtfs_realtime_pb2.FeedMessage()
-    response = requests.get(url, headers={'x-api-key': api_key})
-    feed_message = gtfs_realtime_pb2.FeedMessage()
-    feed_message.ParseFromString(response.content)
-    feed.entity.extend(feed_message.entity)
-
-    LIRR_schedule = []
-
-    for entity in feed.entity:
-        if entity.HasField('trip_update'):
-            trip_update = entity.trip_update
-            for stop_time_update in trip_update.stop_time_update:
-                arrival_time = datetime.fromtimestamp(stop_time_update.arrival.time).strftime("%Y-%m-%d %H:%M:%S")
-                departure_time = datetime.fromtimestamp(stop_time_update.departure.time).strftime("%Y-%m-%d %H:%M:%S")
-                stop_id = stop_time_update.stop_id
-                LIRR_schedule.append({
-                    'route': trip_update.trip.route_id,
-                    'arrival_time': arrival_time,
-                    'departure_time': departure_time,
-                    'stop_id': stop_id
-                })
-
-    return LIRR_schedule
-
-LIRR_schedule = export_LIRR_schedule(subway_API_KEY)
+    content = fetch(url, headers={'x-api-key': api_key}, conditional=has_decoded(url))
+    return decode_if_changed(url, content, decode_trip_updates)
 
 def export_bus_schedule(api_key):
     base_url = 'http://gtfsrt.prod.obanyc.com/tripUpdates'
     request_url = f'{base_url}?key={api_key}'
 
-    response = requests.get(request_url)
-    data = response.content
-
-    feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(data)
-
-    bus_schedule = []
-    
-    for entity in feed.entity:
-        if entity.HasField('trip_update'):
-            trip_update = entity.trip_update
-            route_id = trip_update.trip.route_id
-            for stop_time_update in trip_update.stop_time_update:
-                arrival_time = datetime.fromtimestamp(stop_time_update.arrival.time).strftime("%Y-%m-%d %H:%M:%S")
-                departure_time = datetime.fromtimestamp(stop_time_update.departure.time).strftime("%Y-%m-%d %H:%M:%S")
-                stop_id = stop_time_update.stop_id
-                bus_schedule.append({
-                    'route': route_id,
-                    'arrival_time': arrival_time,
-                    'departure_time': departure_time,
-                    'stop_id': stop_id
-                })
-
-    return bus_schedule
-
-bus_schedule = export_bus_schedule(bus_API_KEY)
+    data = fetch(request_url, conditional=has_decoded(request_url))
+    return decode_if_changed(request_url, data, decode_trip_updates)
 
 def export_bus_location(api_key):
     base_url = "http://gtfsrt.prod.obanyc.com/vehiclePositions"
     request_url = f'{base_url}?key={api_key}'
 
-    response = requests.get(request_url)
-    data = response.content
-
-    feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(data)
-
-    location = []
-    
-    for entity in feed.entity:
-        if entity.HasField('vehicle'):
-            vehicle = entity.vehicle
-            vehicle_id = vehicle.vehicle.id
-            route_id = vehicle.trip.route_id if vehicle.trip.HasField('route_id') else ""
-            direction_id = vehicle.trip.direction_id if vehicle.trip.HasField('direction_id') else None
-            latitude = vehicle.position.latitude
-            longitude = vehicle.position.longitude
-            location.append({
-                'Vehicle ID': vehicle_id,
-                'Route ID': route_id,
-                'Direction ID': direction_id,
-                'Latitude': latitude,
-                'Longitude': longitude
-            })
-
-    return location
-
-bus_location = export_bus_location(bus_API_KEY)
+    data = fetch(request_url, conditional=has_decoded(request_url))
+    return decode_if_changed(request_url, data, decode_vehicle_positions)
+
+# Per route, the arrays a bus location trace is drawn from, built once per refresh so a render
+# only looks them up and masks them to the viewport.
+RouteVehicles = namedtuple('RouteVehicles', ['lat', 'lon', 'customdata'])
+no_vehicles = RouteVehicles(np.empty(0), np.empty(0), np.empty((0, 2), dtype=object))
+
+def index_bus_location(location):
+    lat = location['latitude'].to_numpy(dtype='float64')
+    lon = location['longitude'].to_numpy(dtype='float64')
+    direction_ids = location['direction_id'].astype(object)
+    direction_ids = direction_ids.where(direction_ids.notna(), None).values
+    customdata = np.column_stack([location['vehicle_id'].astype(object).values, direction_ids])
+    return {route_id: RouteVehicles(lat[rows], lon[rows], customdata[rows])
+            for route_id, rows in location.groupby('route_id', observed=True, sort=False).indices.items()}
+
+# Every server process on the host reads realtime data from one store; only the process that
+# wins the store's lock polls MTA, OBA and GBFS. An empty REALTIME_STORE keeps it per-process,
+# which is the default when replaying so a replay never reads or overwrites live snapshots.
+realtime_store_path = os.environ.get('REALTIME_STORE',
+                                     os.path.join(CACHE_DIR, 'realtime.sqlite') if feed_replay is None else '')
+realtime_snapshots = SnapshotCache(store=SnapshotStore(realtime_store_path) if realtime_store_path else None)
+realtime_snapshots.register('subway', lambda: export_subway_schedule(subway_API_KEY), derive=trip_update_snapshot, **poll_timing(30))
+realtime_snapshots.register('bus', lambda: export_bus_schedule(bus_API_KEY), derive=trip_update_snapshot, **poll_timing(30))
+realtime_snapshots.register('bus_location', lambda: export_bus_location(bus_API_KEY), derive=index_bus_location, **poll_timing(30))
+realtime_snapshots.register('LIRR', lambda: export_LIRR_schedule(subway_API_KEY), derive=trip_update_snapshot, **poll_timing(30))
+realtime_snapshots.register('MNR', lambda: export_MNR_schedule(subway_API_KEY), derive=trip_update_snapshot, **poll_timing(30))
+# Polled often, but StationFeed only goes upstream once the status document's GBFS ttl runs out.
+realtime_snapshots.register('citibike', citibike_station_data, **poll_timing(10, ttl=300))
+
+# Every new snapshot is also appended to an hour-partitioned Parquet archive for later analysis;
+# an empty REALTIME_ARCHIVE turns this off, and so does replaying unless it is set explicitly.
+realtime_archive_path = os.environ.get('REALTIME_ARCHIVE', 'archive' if feed_replay is None else '')
+if realtime_archive_path:
+    realtime_archive = SnapshotArchive(realtime_archive_path)
+    for feed in ('subway', 'bus', 'LIRR', 'MNR'):
+        realtime_snapshots.subscribe(feed, lambda updates, fetched_at, version, feed=feed:
+                                     realtime_archive.submit('trip_updates', updates, fetched_at, feed=feed))
+    realtime_snapshots.subscribe('bus_location', lambda location, fetched_at, version:
+                                 realtime_archive.submit('vehicle_positions', location, fetched_at, feed='bus'))
+    realtime_snapshots.subscribe('citibike', lambda citibike, fetched_at, version:
+                                 realtime_archive.submit('citibike_status',
+                                                         citibike.stations.loc[citibike.stations['reporting'].values,
+                                                                               ['station_id'] + STATUS_COLUMNS],
+                                                         fetched_at))
+    realtime_archive.start()
+    # The writer only flushes every flush_interval; stopping it on exit writes what is buffered,
+    # so a restart or deploy does not lose the last few minutes of snapshots.
+    atexit.register(realtime_archive.stop)
+
+realtime_snapshots.start()
 
 styles = {'background': '#262729', 'textColor': '#ffffff', 'marginColor': '#0e1012'}
 
@@ -442,6 +377,8 @@ app.layout = html.Div(
                             dbc.CardBody([
                                 dcc.Graph(id='map'),
                                 html.Div(id='real-time-data', style={'display': 'none'}),
+                                dcc.Store(id='trace-layout'),
+                                dcc.Store(id='map-view', data={'detail': detail_level(DEFAULT_ZOOM), 'bounds': None}),
                                 dcc.Interval(
                                     id='interval-component',
                                     interval=60 * 1000,
@@ -593,53 +530,144 @@ def reset_selections(n_clicks):
         return dash.no_update
     return [], [], [], [], [], [], [], [], [], [], [], [], [], []
     
-def add_bus_location(fig, route_id):
-    bus_data = export_bus_location(bus_API_KEY)
-    bus_df = pd.DataFrame(bus_data)
-    bus_df_route = bus_df[bus_df['Route ID'] == route_id]
+route_trace_cache = SizedLRUCache(max_bytes=64 * 1024 * 1024)
+
+# Trace fields that change between interval ticks; everything else is static per selection.
+realtime_hover_fields = ['customdata']
+realtime_position_fields = ['lon', 'lat', 'customdata']
 
-    fig.add_trace(go.Scattermapbox(
+realtime_stop_template = " <br> Stop Name: %{text} <br> Arrival Time: %{customdata[0]} <br> Departure Time: %{customdata[1]}<extra></extra>"
+
+def add_bus_location(traces, route_id, vehicles, level, bounds):
+    lat, lon, customdata = vehicles.get(route_id, no_vehicles)
+    if bounds is not None:
+        visible = within(lat, lon, bounds)
+        lat, lon, customdata = lat[visible], lon[visible], customdata[visible]
+
+    traces.append(dict(
+        type='scattermapbox',
         name=f"{route_id} Bus Location",
-        lon=bus_df_route['Longitude'],
-        lat=bus_df_route['Latitude'],
+        uid=f"{route_id} Bus Location",
+        meta=realtime_position_fields,
+        lon=quantize(lon, level),
+        lat=quantize(lat, level),
         mode='markers',
         marker=dict(
             size=8, 
             color='red'
         ),
-        text=bus_df_route.apply(lambda x: f"Vehicle ID: {x['Vehicle ID']} <br> Route ID: {x['Route ID']} <br> Direction ID: {x['Direction ID']}", axis=1),
-        hoverinfo='text'
+        customdata=customdata,
+        hovertemplate=f"Vehicle ID: %{{customdata[0]}} <br> Route ID: {route_id} <br> Direction ID: %{{customdata[1]}}<extra></extra>"
     ))
-    return fig
-
-def update_gtfs_map(gdf, feeds):
-    fig = go.Figure()
-
-    all_route_ids = gdf['route_id'].unique()
-
-    for route_id in all_route_ids:
-        route = gdf[gdf['route_id'] == route_id]
-        max_sequence = route['stop_sequence'].max()
-        max_sequence_index = route[route['stop_sequence'] == max_sequence].index[0]
-        longest_sequence = route.loc[max_sequence_index - max_sequence + 1:max_sequence_index]
-        
-        entity_dict = {}
-        for feed in feeds:
-            if feed['route'] == route_id:
-                arrival_time_str = feed['arrival_time']  
-                arrival_time_datetime = datetime.strptime(arrival_time_str, "%Y-%m-%d %H:%M:%S")  
-
-                departure_time_str = feed['departure_time']  
-                departure_time_datetime = datetime.strptime(departure_time_str, "%Y-%m-%d %H:%M:%S") 
-                
-                if arrival_time_datetime.date() < date.today():
-                    arrival_time_datetime = 'N/A'
-                elif departure_time_datetime.date() < date.today():
-                    departure_time_datetime = 'N/A'
-
-                entity_dict[str(feed['stop_id'])] = (arrival_time_datetime, departure_time_datetime)  
-                
-        color = longest_sequence['color'].iloc[0]
+    return traces
+
+def build_route_traces(pattern, route_name, color, hovertemplate, realtime, level, build_key):
+    # Lines are simplified and rounded for the zoom level; stop markers, which carry the
+    # hover text, are only sent once the map is zoomed in far enough to tell them apart.
+    # uids carry build_key, the static build the pattern came from, so a reloaded or rolled
+    # over system never has its realtime fields patched onto another build's stops.
+    stops = pattern.stops
+    meta = realtime_hover_fields if realtime else None
+    show_stops = DETAIL_LEVELS[level]['stops']
+    if pattern.shape_lat is None:
+        if not show_stops:
+            lat, lon = polyline(stops['stop_lat'].values, stops['stop_lon'].values, level)
+            return [dict(
+                type = 'scattermapbox',
+                name = route_name,
+                uid = f"{build_key}/{route_name}/line",
+                lon = lon,
+                lat = lat,
+                mode = 'lines',
+                hoverinfo = 'skip',
+                line=dict(width=3, color=color)
+            )]
+        return [dict(
+            type = 'scattermapbox',
+            name = route_name,
+            uid = f"{build_key}/{route_name}/stops",
+            meta = meta,
+            lon = quantize(stops['stop_lon'].values, level),
+            lat = quantize(stops['stop_lat'].values, level),
+            mode = 'markers+lines',
+            marker = dict(symbol='circle', color="white", size=4),
+            text = stops['stop_name'].values,
+            hovertemplate = hovertemplate,
+            line=dict(width=3, color=color)
+        )]
+
+    lat, lon = polyline(pattern.shape_lat, pattern.shape_lon, level)
+    traces = [dict(
+        type = 'scattermapbox',
+        name = route_name,
+        uid = f"{build_key}/{route_name}/line",
+        legendgroup = route_name,
+        lon = lon,
+        lat = lat,
+        mode = 'lines',
+        hoverinfo = 'skip',
+        line=dict(width=3, color=color)
+    )]
+    if show_stops:
+        traces.append(dict(
+            type = 'scattermapbox',
+            name = route_name,
+            uid = f"{build_key}/{route_name}/stops",
+            meta = meta,
+            legendgroup = route_name,
+            showlegend = False,
+            lon = quantize(stops['stop_lon'].values, level),
+            lat = quantize(stops['stop_lat'].values, level),
+            mode = 'markers',
+            marker = dict(symbol='circle', color="white", size=4),
+            text = stops['stop_name'].values,
+            hovertemplate = hovertemplate
+        ))
+    return traces
+
+def add_route_trace(traces, system, route_id, route_name, color, hovertemplate, level, bounds, next_stop_times=None):
+    # The static part of a route's traces, including stop names and the hover template, is
+    # shared by every callback and user; only the realtime customdata is merged in per render.
+    realtime = next_stop_times is not None
+    route_traces = route_trace_cache.get_or_build(
+        (system.key, route_id, level),
+        lambda: build_route_traces(system.route_pattern(route_id), route_name, color, hovertemplate,
+                                   realtime, level, system.key))
+    for trace in route_traces:
+        customdata = None
+        if realtime and 'hovertemplate' in trace:
+            customdata = stop_time_customdata(system, route_id, next_stop_times)
+        if bounds is not None and trace['mode'] == 'markers':
+            # Stop markers outside the view are dropped; lines are kept whole so they still
+            # run off the edge of the map.
+            visible = within(trace['lat'], trace['lon'], bounds)
+            trace = dict(trace, lat=trace['lat'][visible], lon=trace['lon'][visible], text=trace['text'][visible])
+            if customdata is not None:
+                customdata = customdata[visible]
+        if customdata is not None:
+            trace = dict(trace, customdata=customdata)
+        traces.append(trace)
+    return traces
+
+# (system name, route_id) -> (system key, next_stop_times, customdata). A snapshot's next stop
+# times are one object until the next refresh, so each route is joined once per snapshot
+# instead of on every render and interval tick.
+stop_time_customdata_cache = {}
+
+def stop_time_customdata(system, route_id, next_stop_times):
+    cached = stop_time_customdata_cache.get((system.name, route_id))
+    if cached is not None and cached[0] == system.key and cached[1] is next_stop_times:
+        return cached[2]
+    stops = join_stop_times(system.route_pattern(route_id).stops, next_stop_times.get(route_id))
+    customdata = stops[['arrival_time', 'departure_time']].values
+    stop_time_customdata_cache[(system.name, route_id)] = (system.key, next_stop_times, customdata)
+    return customdata
+
+def update_gtfs_map(system, route_ids, next_stop_times, level, bounds, vehicles=None):
+    traces = []
+
+    for route_id in system.select_routes(route_ids):
+        color = system.route_attribute(route_id, 'color')
         if color == '#000000':
             color = 'blue'
             
@@ -648,160 +676,88 @@ def update_gtfs_map(gdf, feeds):
         else:
             route_name = f"Bus Route {route_id}"
 
-        fig.add_trace(go.Scattermapbox(
-            name = route_name,
-            lon = longest_sequence.geometry.x,
-            lat = longest_sequence.geometry.y,
-            mode = 'markers+lines',
-            marker = dict(symbol='circle', color="white", size=4),
-            text = longest_sequence.apply(lambda x: f"Route: {x['route_id']} <br> Stop Name: {x['stop_name']} <br> Arrival Time: {entity_dict.get(str(x['stop_id']), ('N/A', 'N/A'))[0]} <br> Departure Time: {entity_dict.get(str(x['stop_id']), ('N/A', 'N/A'))[1]}", axis=1),
-            hoverinfo = 'text',
-            line=dict(width=3, color=color)
-        ))
+        add_route_trace(traces, system, route_id, route_name, color,
+                        f"Route: {route_id}" + realtime_stop_template, level, bounds, next_stop_times)
         
-        fig = add_bus_location(fig, route_id)
+        if vehicles is not None:
+            add_bus_location(traces, route_id, vehicles, level, bounds)
         
-    return fig
-
-def update_map(gdf, gdf_name):
-    fig = go.Figure()
-    all_route_ids = gdf['route_id'].unique()
+    return traces
 
-    for route_id in all_route_ids:
-        route = gdf[gdf['route_id'] == route_id]
-        max_sequence = route['stop_sequence'].max()
-        max_sequence_index = route[route['stop_sequence'] == max_sequence].index[0]
-        longest_sequence = route.loc[max_sequence_index - max_sequence + 1:max_sequence_index]
+def update_map(system, route_ids, gdf_name, level, bounds):
+    traces = []
 
+    for route_id in system.select_routes(route_ids):
         if gdf_name in 'NJ_gdf':
             route_name = f"NJ Rail Route {route_id}"
         else:
             route_name = f"Route {route_id}"
 
-        fig.add_trace(go.Scattermapbox(
-            name= route_name,
-            lon=longest_sequence.geometry.x,
-            lat=longest_sequence.geometry.y,
-            mode='markers+lines',
-            marker=dict(symbol='circle', color="white", size=4),
-            text=longest_sequence.apply(lambda x: f"Route: {x['route_id']} <br> Stop Name: {x['stop_name']} ", axis=1),
-            hoverinfo='text',
-            line=dict(width=3, color=longest_sequence['color'].iloc[0])
-        ))
+        add_route_trace(traces, system, route_id, route_name, system.route_attribute(route_id, 'color'),
+                        f"Route: {route_id} <br> Stop Name: %{{text}} <extra></extra>", level, bounds)
         
-    return fig
+    return traces
 
-def update_MNR_map(gdf, feeds):
-    fig = go.Figure()
-    all_route_ids = gdf['route_id'].unique()
+def update_MNR_map(system, route_ids, next_stop_times, level, bounds):
+    traces = []
     
-    for route_id in all_route_ids:
-        route = gdf[gdf['route_id'] == route_id]
-        route_long_name = route['route_long_name'].unique()[0]
-        grouped = route.groupby('trip_id')
-        longest_group = grouped.apply(lambda x: x['route_id'].count()).idxmax()
-        selected_group = grouped.get_group(longest_group)
-        selected_group['stop_id'] = selected_group['stop_id'].astype(str)
-        
-        entity_dict = {}
-        for feed in feeds:
-            if str(feed['route']) == str(route_id):
-                arrival_time_str = feed['arrival_time']
-                arrival_time_datetime = datetime.strptime(arrival_time_str, "%Y-%m-%d %H:%M:%S")
+    for route_id in system.select_routes(route_ids):
+        route_long_name = system.route_attribute(route_id, 'route_long_name')
+        add_route_trace(traces, system, route_id, f"MNR Route {route_id}", system.route_attribute(route_id, 'color'),
+                        f"Route: {route_id, route_long_name}" + realtime_stop_template, level, bounds, next_stop_times)
 
-                departure_time_str = feed['departure_time']
-                departure_time_datetime = datetime.strptime(departure_time_str, "%Y-%m-%d %H:%M:%S")
+    return traces
 
-                if arrival_time_datetime.date() < date.today():
-                    arrival_time_datetime = 'N/A'
-                elif departure_time_datetime.date() < date.today():
-                    departure_time_datetime = 'N/A'
+def update_LIRR_map(system, route_ids, next_stop_times, level, bounds):
+    traces = []
 
-                entity_dict[str(feed['stop_id'])] = (arrival_time_datetime, departure_time_datetime)  
+    for route_id in system.select_routes(route_ids):
+        route_long_name = system.route_attribute(route_id, 'route_long_name')
+        add_route_trace(traces, system, route_id, f"LIRR Route {route_id}", system.route_attribute(route_id, 'color'),
+                        f"Route: {route_id, route_long_name}" + realtime_stop_template, level, bounds, next_stop_times)
         
-        fig.add_trace(go.Scattermapbox(
-            name=f"MNR Route {route_id}",
-            lon=selected_group.geometry.x,
-            lat=selected_group.geometry.y,
-            mode='markers+lines',
-            marker=dict(symbol='circle', color="white", size=4),
-            text=selected_group.apply(
-                lambda x: f"Route: {x['route_id'], x['route_long_name']} <br> Stop Name: {x['stop_name']} <br> Arrival Time: {entity_dict.get(str(x['stop_id']), ('N/A', 'N/A'))[0]} <br> Departure Time: {entity_dict.get(str(x['stop_id']), ('N/A', 'N/A'))[1]}", axis=1),
-            hoverinfo = 'text',
-            line=dict(width=3, color=selected_group['color'].iloc[0])  
-        ))
-
-    return fig
-
-def update_LIRR_map(gdf, feeds):
-    fig = go.Figure()
-    all_route_ids = gdf['route_id'].unique()
+    return traces
 
-    for route_id in all_route_ids:
-        route = gdf[gdf['route_id'] == route_id]
-        max_sequence = route['stop_sequence'].max()
-        max_sequence_index = route[route['stop_sequence'] == max_sequence].index[0]
-        longest_sequence = route.loc[max_sequence_index - max_sequence + 1 : max_sequence_index]
-
-        entity_dict = {}
-        for feed in feeds:
-            if str(feed['route']) == str(route_id):
-                arrival_time_str = feed['arrival_time']
-                arrival_time_datetime = datetime.strptime(arrival_time_str, "%Y-%m-%d %H:%M:%S")
-
-                departure_time_str = feed['departure_time']
-                departure_time_datetime = datetime.strptime(departure_time_str, "%Y-%m-%d %H:%M:%S")
-
-                if arrival_time_datetime.date() < date.today():
-                    arrival_time_datetime = 'N/A'
-                elif departure_time_datetime.date() < date.today():
-                    departure_time_datetime = 'N/A'
-
-                entity_dict[str(feed['stop_id'])] = (arrival_time_datetime, departure_time_datetime)   
-        
-        fig.add_trace(go.Scattermapbox(
-            name=f"LIRR Route {route_id}",
-            lon=longest_sequence.geometry.x,
-            lat=longest_sequence.geometry.y,
-            mode='markers+lines',
-            marker=dict(symbol='circle', color="white", size=4),
-            text=longest_sequence.apply(
-                lambda x: f"Route: {x['route_id'], x['route_long_name']} <br> Stop Name: {x['stop_name']} <br> Arrival Time: {entity_dict.get(str(x['stop_id']), ('N/A', 'N/A'))[0]} <br> Departure Time: {entity_dict.get(str(x['stop_id']), ('N/A', 'N/A'))[1]}", axis=1),
-            hoverinfo = 'text',
-            line=dict(width=3, color=longest_sequence['color'].iloc[0])  
-        ))
-        
-    return fig
-
-def update_citibike_map(citibike_gdf):
-    fig = go.Figure()
+def update_citibike_map(citibike_gdf, level):
+    traces = []
     
-    citibike_gdf['last_reported'] = citibike_gdf['last_reported'].apply(lambda x: datetime.fromtimestamp(int(x)))
+    last_reported = format_epochs(citibike_gdf['last_reported'].astype('int64').values)
     citibike_regions = citibike_gdf['region_name'].unique()
     region_color_mapping = {'NYC District': 'blue', 'JC District': 'green','Hoboken District': 'red'}
     
     for region in citibike_regions:
-        citibike = citibike_gdf[citibike_gdf['region_name'] == region]
+        in_region = (citibike_gdf['region_name'] == region).values
+        citibike = citibike_gdf[in_region]
         region_color = region_color_mapping.get(region, 'blue')
 
-        fig.add_trace(go.Scattermapbox(
+        # Station positions and names stay put between ticks, so only customdata is patched; the
+        # uid carries a checksum of them so a changed set of stations gets a full render instead.
+        stations_key = zlib.crc32(citibike['name'].str.cat(sep='\n').encode(),
+                                  zlib.crc32(citibike[['lat', 'lon']].to_numpy(dtype='float64').tobytes()))
+        traces.append(dict(
+            type='scattermapbox',
             name=f" Citibike - {region}",
-            lon=citibike.geometry.x,
-            lat=citibike.geometry.y,
+            uid=f"Citibike/{region}/{stations_key:08x}",
+            meta=realtime_hover_fields,
+            lon=quantize(citibike['lon'].values, level),
+            lat=quantize(citibike['lat'].values, level),
             mode='markers',
             marker=dict(
                 size=4,
                 color= region_color
             ),
-            text=citibike.apply(lambda x: f"Name: {x['name']} <br> Available Docks: {x['num_docks_available']} <br> Available eBikes: {x['num_ebikes_available']} <br> Available Bikes: {x['num_bikes_available']} <br> Last Reported: {x['last_reported']}", axis=1),
-            hoverinfo='text'
+            text=citibike['name'].values,
+            customdata=np.column_stack([citibike['num_docks_available'].values, citibike['num_ebikes_available'].values,
+                                        citibike['num_bikes_available'].values, last_reported[in_region]]),
+            hovertemplate="Name: %{text} <br> Available Docks: %{customdata[0]} <br> Available eBikes: %{customdata[1]} <br> Available Bikes: %{customdata[2]} <br> Last Reported: %{customdata[3]}<extra></extra>"
         ))
 
-    return fig
+    return traces
 
 @app.callback(
     [Output('map', 'figure'),
-     Output('real-time-data', 'children')],
+     Output('real-time-data', 'children'),
+     Output('trace-layout', 'data')],
     [Input('route-selector', 'value'),
      Input('boroughs_chosen', 'value'),
      Input('bus-routes-dropdown', 'value'),
@@ -809,64 +765,66 @@ def update_citibike_map(citibike_gdf):
      Input('lirr-route-selector', 'value'),
      Input('mnr-route-selector', 'value'),
      Input('nj-transit-route-selector', 'value'),
-     Input('interval-component', 'n_intervals')]
+     Input('interval-component', 'n_intervals'),
+     Input('map-view', 'data')],
+    [State('trace-layout', 'data')]
 )
 
-def update_map_and_real_time_data(subway_routes, boroughs, bus_routes, citibike_region, LIRR_routes, MNR_routes, NJrail_routes, n):
-    fig = go.Figure()
+def update_map_and_real_time_data(subway_routes, boroughs, bus_routes, citibike_region, LIRR_routes, MNR_routes, NJrail_routes, n, map_view, current_layout):
+    callback_started = time.perf_counter()
+    # Traces are plain dicts: the full figure is only assembled when it is sent, and an
+    # interval tick that sends a Patch never pays for plotly's per-trace validation.
+    traces = []
+    level = map_view['detail']
+    bounds = map_view.get('bounds')
     subway_schedule = None
     bus_schedule = None
-    schedule_json = None
     MNR_schedule = None
     LIRR_schedule = None
+    # (feed, snapshot version) of each schedule shown, for deciding whether to resend the JSON.
+    schedule_versions = {}
     
-    if subway_routes is not None:
-        subway_schedule = export_subway_schedule(subway_API_KEY)
-        subway_gdf = dataframes['subway'][dataframes['subway']['route_id'].isin(subway_routes)]
-        subway_fig = update_gtfs_map(subway_gdf, subway_schedule)
-        for trace in subway_fig.data:
-            fig.add_trace(trace)
-        
-    if boroughs is not None and bus_routes is not None:
-        bus_schedule = export_bus_schedule(bus_API_KEY)
-        for borough in boroughs:
-            bus_gdf = dataframes[f'bus_{borough.lower()}'][dataframes[f'bus_{borough.lower()}']['route_id'].isin(bus_routes)]
-            bus_fig = update_gtfs_map(bus_gdf, bus_schedule)
-            for trace in bus_fig.data:
-                fig.add_trace(trace)
-    
-    if citibike_region is not None:
-        citibike_gdf = citibike_station_data()
-        citibike_gdf = citibike_gdf[citibike_gdf['region_name'].isin(citibike_region)]
-        citibike_fig = update_citibike_map(citibike_gdf)
-        for trace in citibike_fig.data:
-            fig.add_trace(trace)
-            
-    if LIRR_routes is not None:
-        LIRR_schedule = export_LIRR_schedule(subway_API_KEY)
-        LIRR_gdf = dataframes['LIRR'][dataframes['LIRR']['route_id'].isin(LIRR_routes)]
-        LIRR_fig = update_LIRR_map(LIRR_gdf, LIRR_schedule)
-        for trace in LIRR_fig.data:
-            fig.add_trace(trace)
-            
-    if MNR_routes is not None:
-        MNR_schedule = export_MNR_schedule(subway_API_KEY)
-        MNR_gdf = dataframes['MNR'][dataframes['MNR']['route_id'].isin(MNR_routes)]
-        MNR_fig = update_MNR_map(MNR_gdf, MNR_schedule)
-        for trace in MNR_fig.data:
-            fig.add_trace(trace)
-            
-    if NJrail_routes is not None:
-        NJ_gdf = dataframes['NJ_rail'][dataframes['NJ_rail']['route_id'].isin(NJrail_routes)]
-        NJ_fig = update_map(NJ_gdf, 'NJ_gdf')
-        for trace in NJ_fig.data:
-            fig.add_trace(trace)
-            
-    fig.add_trace(go.Scattermapbox(
+    with timer('map_callback_stage_seconds', stage='subway'):
+        if subway_routes is not None:
+            subway_schedule, schedule_versions['subway'] = realtime_snapshots.get_versioned('subway', empty_trip_update_snapshot())
+            traces.extend(update_gtfs_map(static_feeds['subway'], subway_routes, subway_schedule.next_stop_times, level, bounds))
+
+    with timer('map_callback_stage_seconds', stage='bus'):
+        if boroughs is not None and bus_routes is not None:
+            bus_schedule, schedule_versions['bus'] = realtime_snapshots.get_versioned('bus', empty_trip_update_snapshot())
+            bus_vehicles = realtime_snapshots.get('bus_location', {})
+            for borough in boroughs:
+                traces.extend(update_gtfs_map(static_feeds[f'bus_{borough.lower()}'], bus_routes, bus_schedule.next_stop_times, level, bounds, bus_vehicles))
+
+    with timer('map_callback_stage_seconds', stage='citibike'):
+        citibike = realtime_snapshots.get('citibike')
+        if citibike_region is not None and citibike is not None:
+            citibike_gdf, station_index = citibike
+            citibike_gdf = citibike_gdf.iloc[station_index.query(bounds)]
+            citibike_gdf = citibike_gdf[citibike_gdf['reporting'].values & citibike_gdf['region_name'].isin(citibike_region).values]
+            traces.extend(update_citibike_map(citibike_gdf, level))
+
+    with timer('map_callback_stage_seconds', stage='LIRR'):
+        if LIRR_routes is not None:
+            LIRR_schedule, schedule_versions['LIRR'] = realtime_snapshots.get_versioned('LIRR', empty_trip_update_snapshot())
+            traces.extend(update_LIRR_map(static_feeds['LIRR'], LIRR_routes, LIRR_schedule.next_stop_times, level, bounds))
+
+    with timer('map_callback_stage_seconds', stage='MNR'):
+        if MNR_routes is not None:
+            MNR_schedule, schedule_versions['MNR'] = realtime_snapshots.get_versioned('MNR', empty_trip_update_snapshot())
+            traces.extend(update_MNR_map(static_feeds['MNR'], MNR_routes, MNR_schedule.next_stop_times, level, bounds))
+
+    with timer('map_callback_stage_seconds', stage='NJ_rail'):
+        if NJrail_routes is not None:
+            traces.extend(update_map(static_feeds['NJ_rail'], NJrail_routes, 'NJ_gdf', level, bounds))
+
+    traces.append(dict(
+        type='scattermapbox',
+        uid='anchor',
         lat=[40.8],  # Default latitude
         lon=[-74],  # Default longitude
         mode='markers',
-        marker=go.scattermapbox.Marker(
+        marker=dict(
             size=0,  # Set size to 0 for transparency
             color='rgba(0, 0, 0, 0)'  # Set color to transparent
         ),
@@ -874,13 +832,42 @@ def update_map_and_real_time_data(subway_routes, boroughs, bus_routes, citibike_
         showlegend=False
     ))
 
-
-    fig.update_layout(
+    # The hidden div gets the updates of the last selected system that has any, and only when
+    # that snapshot changed since this browser last received it.
+    rendered = current_layout if isinstance(current_layout, dict) else {}
+    with timer('map_callback_stage_seconds', stage='schedule_json'):
+        schedule_source = None
+        for feed, schedule in (('subway', subway_schedule), ('bus', bus_schedule), ('MNR', MNR_schedule), ('LIRR', LIRR_schedule)):
+            if schedule is not None and not schedule.updates.empty:
+                schedule_source = [feed, schedule_versions[feed]]
+        if schedule_source is not None and schedule_source == rendered.get('schedule'):
+            schedule_json = dash.no_update
+        elif schedule_source is not None:
+            schedule = {'subway': subway_schedule, 'bus': bus_schedule, 'MNR': MNR_schedule, 'LIRR': LIRR_schedule}[schedule_source[0]]
+            schedule_json = schedule.updates.to_json(orient='records')
+        else:
+            schedule_json = None
+
+    # On an interval tick with an unchanged selection the browser already holds the static
+    # traces, so only the realtime fields are sent as a partial update.
+    trace_layout = [trace['uid'] for trace in traces]
+    layout_state = {'traces': trace_layout, 'schedule': schedule_source}
+    if dash.ctx.triggered_id == 'interval-component' and trace_layout == rendered.get('traces'):
+        patched_figure = Patch()
+        for index, trace in enumerate(traces):
+            for field in trace.get('meta') or []:
+                patched_figure['data'][index][field] = trace.get(field)
+        record_map_callback('patch', callback_started)
+        return patched_figure, schedule_json, dash.no_update if layout_state == rendered else layout_state
+
+    layout = dict(
         mapbox = {
             'center': {"lat": 40.8, "lon": -74},
             'style': "carto-darkmatter",
-            'zoom': 10
+            'zoom': DEFAULT_ZOOM
         },
+        # Keeps the user's pan and zoom when a new detail level re-renders the figure.
+        uirevision='map',
         margin=dict(l=0, r=0, b=0, t=0),
         hovermode="closest",
         plot_bgcolor="#e4ebf5",
@@ -900,17 +887,123 @@ def update_map_and_real_time_data(subway_routes, boroughs, bus_routes, citibike_
             borderwidth=2
         )    
     )
-    
-    if subway_schedule :
-        schedule_json = json.dumps(subway_schedule)
-    if bus_schedule:
-        schedule_json = json.dumps(bus_schedule)
-    if MNR_schedule:
-        schedule_json = json.dumps(MNR_schedule)
-    if LIRR_schedule:
-        schedule_json = json.dumps(LIRR_schedule)
-        
-    return fig, schedule_json
+
+    record_map_callback('figure', callback_started)
+    return {'data': traces, 'layout': layout}, schedule_json, layout_state
+
+
+metrics.describe('map_callback_seconds', 'histogram', 'Time spent building the map callback response.')
+metrics.describe('map_callback_stage_seconds', 'histogram', 'Time per stage of the map callback, including serialization.')
+metrics.describe('map_response_bytes', 'histogram', 'Serialized size of the map callback response.',
+                 buckets=(10_000, 100_000, 250_000, 500_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000, 16_000_000))
+
+def record_map_callback(response, started):
+    elapsed = time.perf_counter() - started
+    metrics.observe('map_callback_seconds', elapsed, response=response)
+    if flask.has_request_context():
+        flask.g.map_callback_seconds = elapsed
+
+@app.server.before_request
+def start_request_timer():
+    flask.g.request_started = time.perf_counter()
+
+@app.server.after_request
+def record_map_response(response):
+    # Dash serializes the figure after the callback returns, so what remains of the request
+    # time is serialization, and the payload size is read off the response already built.
+    if 'map_callback_seconds' in flask.g:
+        serialize = time.perf_counter() - flask.g.request_started - flask.g.map_callback_seconds
+        metrics.observe('map_callback_stage_seconds', serialize, stage='serialize')
+        metrics.observe('map_response_bytes', response.calculate_content_length() or 0)
+    return response
+
+
+@app.callback(
+    Output('map-view', 'data'),
+    [Input('map', 'relayoutData')],
+    [State('map-view', 'data')]
+)
+
+def update_map_view(relayout_data, current_view):
+    # Panning and zooming fire relayoutData constantly; the map is only rebuilt when the zoom
+    # crosses into another detail level or the view leaves the snapped, padded bounds.
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        return dash.no_update
+    view = dict(current_view, detail=detail_level(relayout_data['mapbox.zoom']))
+    derived = relayout_data.get('mapbox._derived')
+    if derived and 'coordinates' in derived:
+        view['bounds'] = view_bounds(derived['coordinates'])
+    return dash.no_update if view == current_view else view
+
+
+@app.server.route('/stats/trace-cache')
+def trace_cache_stats():
+    return route_trace_cache.stats()
+
+
+@app.server.route('/stats/static-systems')
+def static_system_stats():
+    return static_feeds.stats()
+
+
+metrics.describe('realtime_snapshot_age_seconds', 'gauge', 'Seconds since the realtime feed was last fetched.')
+metrics.describe('realtime_snapshot_version', 'gauge', 'Version of the current realtime snapshot.')
+metrics.describe('realtime_refresh_failing', 'gauge', '1 while the last refresh of the realtime feed failed.')
+metrics.describe('static_systems_loaded', 'gauge', 'Static systems held in memory.')
+metrics.describe('static_systems_bytes', 'gauge', 'Memory held by loaded static systems.')
+metrics.describe('static_service_bytes_saved', 'gauge', 'Static table bytes left out because their trips do not run on the service date.')
+metrics.describe('route_trace_cache_bytes', 'gauge', 'Memory held by cached route traces.')
+metrics.describe('route_trace_cache_hits_total', 'counter', 'Route trace cache hits.')
+metrics.describe('route_trace_cache_misses_total', 'counter', 'Route trace cache misses.')
+
+def collect_state_metrics():
+    for feed, status in realtime_snapshots.status().items():
+        if status['age'] is not None:
+            yield 'realtime_snapshot_age_seconds', {'feed': feed}, status['age']
+        yield 'realtime_snapshot_version', {'feed': feed}, status['version'] or 0
+        yield 'realtime_refresh_failing', {'feed': feed}, int(status['error'] is not None)
+    systems = static_feeds.stats()
+    yield 'static_systems_loaded', {}, systems['entries']
+    yield 'static_systems_bytes', {}, systems['bytes']
+    for system, status in static_feeds.status().items():
+        if 'bytes_saved' in status:
+            yield 'static_service_bytes_saved', {'system': system}, status['bytes_saved']
+    traces = route_trace_cache.stats()
+    yield 'route_trace_cache_bytes', {}, traces['bytes']
+    yield 'route_trace_cache_hits_total', {}, traces['hits']
+    yield 'route_trace_cache_misses_total', {}, traces['misses']
+
+metrics.register_collector(collect_state_metrics)
+
+
+@app.server.route('/metrics')
+def prometheus_metrics():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.server.route('/healthz')
+def healthz():
+    return {'status': 'ok', 'uptime_seconds': round(time.monotonic() - startup_began, 1)}
+
+
+@app.server.route('/readyz')
+def readyz():
+    # Ready once the preloaded systems are in memory and every realtime feed has either its
+    # first snapshot or a recorded error; other systems load on first selection.
+    static_loaded_at = static_feeds.loaded_at(static_preload)
+    realtime_settled_at = realtime_snapshots.settled_at()
+    ready = static_loaded_at is not None and realtime_settled_at is not None
+    body = {
+        'ready': ready,
+        'startup_seconds': startup_seconds,
+        'ready_seconds': round(max(static_loaded_at or 0, realtime_settled_at or 0) - startup_began, 3) if ready else None,
+        'static': static_feeds.status(),
+        'realtime': realtime_snapshots.status(),
+    }
+    return body, 200 if ready else 503
+
+# Everything above is local work; realtime feeds and preloaded systems warm up in the background.
+startup_seconds = round(time.monotonic() - startup_began, 3)
 
 
 if __name__ == '__main__':
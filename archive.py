@@ -0,0 +1,149 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rows of each kind are sorted by this column before writing, so row-group statistics let a
+# query for one route, stop or station skip most of every file.
+SORT_COLUMNS = {
+    'trip_updates': ['route_id', 'stop_id'],
+    'vehicle_positions': ['route_id'],
+    'citibike_status': ['station_id'],
+}
+
+PARTITIONING = ds.partitioning(pa.schema([('hour', pa.string())]), flavor='hive')
+
+metrics.describe('archive_rows_written_total', 'counter', 'Snapshot rows written to the archive.')
+metrics.describe('archive_dropped_total', 'counter', 'Snapshots dropped because the archive queue was full.')
+metrics.describe('archive_write_seconds', 'histogram', 'Time to write one archive part file.')
+metrics.describe('archive_queue_depth', 'gauge', 'Snapshots waiting for the archive writer.')
+
+
+def hour_partition(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H')
+
+
+class SnapshotArchive:
+    # Append-only Parquet archive of realtime snapshots, partitioned by UTC hour:
+    #   <root>/<kind>/hour=2024-05-01T13/part-<uuid>.parquet
+    # submit() only enqueues; a writer thread buffers each kind and hour and writes a part
+    # file every flush_interval seconds or when the hour rolls over.
+    def __init__(self, root, max_queue=256, flush_interval=300, compression='zstd'):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._buffers = {}
+        self._thread = None
+        self._stop = threading.Event()
+        metrics.register_collector(lambda: [('archive_queue_depth', {}, self._queue.qsize())])
+
+    def submit(self, kind, frame, fetched_at, **columns):
+        # Never blocks the caller: when the writer falls behind, the snapshot is dropped.
+        if frame.empty:
+            return False
+        try:
+            self._queue.put_nowait((kind, frame, fetched_at, columns))
+        except queue.Full:
+            metrics.inc('archive_dropped_total', kind=kind)
+            return False
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                kind, frame, fetched_at, columns = self._queue.get(timeout=1)
+            except queue.Empty:
+                pass
+            else:
+                self._buffer(kind, frame, fetched_at, columns)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+
+    def _buffer(self, kind, frame, fetched_at, columns):
+        hour = hour_partition(fetched_at)
+        # A snapshot from a new hour closes the previous hour's buffer for that kind.
+        for key in [key for key in self._buffers if key[0] == kind and key[1] != hour]:
+            self._write(key, self._buffers.pop(key))
+        table = frame.reset_index(drop=True)
+        for column in table.columns:
+            if isinstance(table[column].dtype, pd.CategoricalDtype):
+                table[column] = table[column].astype(str)
+        for column, value in columns.items():
+            table[column] = value
+        table['fetched_at'] = pd.Timestamp(fetched_at, unit='s', tz='UTC')
+        self._buffers.setdefault((kind, hour), []).append(table)
+
+    def flush(self):
+        for key in list(self._buffers):
+            self._write(key, self._buffers.pop(key))
+
+    def _write(self, key, tables):
+        kind, hour = key
+        started = time.perf_counter()
+        try:
+            frame = pd.concat(tables, ignore_index=True)
+            sort_columns = [column for column in SORT_COLUMNS.get(kind, []) if column in frame]
+            if sort_columns:
+                frame = frame.sort_values(sort_columns, kind='stable')
+            folder = os.path.join(self.root, kind, f'hour={hour}')
+            os.makedirs(folder, exist_ok=True)
+            name = f'part-{uuid.uuid4().hex}.parquet'
+            # Written under a dot-name first; dataset discovery skips those until the rename.
+            tmp_path = os.path.join(folder, f'.{name}.tmp')
+            pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path,
+                           compression=self.compression, row_group_size=64 * 1024)
+            os.replace(tmp_path, os.path.join(folder, name))
+        except Exception:
+            logger.exception('writing %s archive for %s failed', kind, hour)
+            return
+        metrics.observe('archive_write_seconds', time.perf_counter() - started, kind=kind)
+        metrics.inc('archive_rows_written_total', len(frame), kind=kind)
+
+    def read(self, kind, start, end, columns=None, **equals):
+        # Rows of kind fetched in [start, end] (epoch seconds or datetimes), optionally only
+        # where columns equal the given values, e.g. read('trip_updates', t0, t1, stop_id='127N').
+        # Hour partitions outside the range are never opened.
+        folder = os.path.join(self.root, kind)
+        if not os.path.isdir(folder):
+            return pd.DataFrame(columns=columns)
+        # Naive datetimes are local time, like the rest of the app.
+        start = pd.Timestamp(start.timestamp() if isinstance(start, datetime) else start, unit='s', tz='UTC')
+        end = pd.Timestamp(end.timestamp() if isinstance(end, datetime) else end, unit='s', tz='UTC')
+
+        dataset = ds.dataset(folder, format='parquet', partitioning=PARTITIONING)
+        condition = (ds.field('hour') >= hour_partition(start.timestamp())) & \
+                    (ds.field('hour') <= hour_partition(end.timestamp())) & \
+                    (ds.field('fetched_at') >= start) & (ds.field('fetched_at') <= end)
+        for column, value in equals.items():
+            condition = condition & (ds.field(column) == value)
+        table = dataset.to_table(columns=columns, filter=condition)
+        return table.to_pandas().drop(columns=['hour'], errors='ignore')
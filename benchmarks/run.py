@@ -0,0 +1,261 @@
+"""Time the static load, realtime decoders, map builders and the map callback.
+
+    python benchmarks/run.py                     # compare with benchmarks/baseline.json
+    python benchmarks/run.py --save-baseline     # record a new baseline
+    python benchmarks/run.py --fixtures DIR      # replay recorded feeds instead of synthetic ones
+
+The app runs in a scratch directory filled by synthetic_gtfs.py, with every upstream
+request answered from the realtime fixtures, so no network access is needed. Recorded
+fixtures use the same file names: trip_updates.pb, vehicle_positions.pb and the three
+GBFS documents.
+
+The run exits non-zero when a benchmark slows down by more than both the tolerance and the
+floor, or a rendered figure is larger than its map_detail.PAYLOAD_TARGET_BYTES target.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import plotly.io
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fetch  # noqa: E402
+import gtfs_rt  # noqa: E402
+from gtfs_static import (SERVICE_TABLES, StaticFeed, build_cache, build_system_tables, load_system,  # noqa: E402
+                         read_cache, select_services)
+from map_detail import PAYLOAD_TARGET_BYTES  # noqa: E402
+from synthetic_gtfs import SYSTEMS, write_fixtures  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MiB = 1024 * 1024
+FAST_SECONDS = 0.01
+FAST_REPEAT = 25
+
+SIZES = {
+    'routes': 50,
+    'trips': 100,
+    'stops': 2000,
+    'stops_per_trip': 30,
+    'shape_points': 200,
+    'active_trips': 20,
+    'vehicles': 10,
+    'stations': 2000,
+}
+
+
+class FixtureSource:
+    # Answers every request the app makes from a fixture file picked by its URL, through the
+    # same fetch.set_source() hook replay mode uses.
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+
+    def fixture_for(self, url):
+        for name in ('station_information', 'station_status', 'system_regions'):
+            if name in url:
+                return os.path.join(self.fixtures, f'{name}.json')
+        if 'vehiclePositions' in url:
+            return os.path.join(self.fixtures, 'vehicle_positions.pb')
+        return os.path.join(self.fixtures, 'trip_updates.pb')
+
+    def fetch(self, url, conditional=False):
+        with open(self.fixture_for(url), 'rb') as fixture:
+            return fixture.read()
+
+
+def install_replay(fixtures):
+    fetch.set_source(FixtureSource(fixtures))
+
+
+def forget_decoded():
+    # decode_if_changed skips feeds whose header timestamp it has seen; benchmarks want the work.
+    gtfs_rt._decoded.clear()
+    gtfs_rt._combined.clear()
+
+
+def measure(name, func, setup=None, repeat=5):
+    # Benchmarks faster than FAST_SECONDS get up to FAST_REPEAT runs, since the median of a
+    # few millisecond-long runs is mostly scheduler noise.
+    timings = []
+    while len(timings) < repeat or (len(timings) < FAST_REPEAT and statistics.median(timings) < FAST_SECONDS):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return name, {'seconds': statistics.median(timings), 'peak_bytes': peak}, result
+
+
+def call_map_callback(app, trigger, map_view, current_layout=None, boroughs=None, citibike_regions=None):
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+
+    context_value.set(AttributeDict(triggered_inputs=[{'prop_id': trigger, 'value': None}]))
+    boroughs = app.boroughs if boroughs is None else boroughs
+    bus_routes = [route_id for borough in boroughs
+                  for route_id in app.static_feeds.route_ids(f'bus_{borough.lower()}')]
+    return app.update_map_and_real_time_data(
+        list(app.subway_id), boroughs, bus_routes, citibike_regions or app.citibike_regions,
+        list(app.LIRR_id), list(app.MNR_id), list(app.NJ_rail_id), 0, map_view, current_layout)
+
+
+def run_benchmarks(fixtures):
+    results = {}
+
+    def record(name, func, setup=None, repeat=5):
+        name, result, value = measure(name, func, setup, repeat)
+        results[name] = result
+        print(f"{name:<40} {result['seconds'] * 1000:>10.1f} ms {result['peak_bytes'] / MiB:>9.1f} MiB", flush=True)
+        return value
+
+    record('static build from csv', lambda: StaticFeed('subway', **build_system_tables('GTFS/subway')), repeat=3)
+    load_system('subway')
+    record('static load from arrow cache', lambda: load_system('subway'))
+    # Service A of the synthetic calendar has half of the trips.
+    tables = read_cache(build_cache('subway')[1], SERVICE_TABLES)
+    record('static service selection', lambda: select_services(tables, {'A'}))
+
+    with open(os.path.join(fixtures, 'trip_updates.pb'), 'rb') as fixture:
+        trip_updates = fixture.read()
+    with open(os.path.join(fixtures, 'vehicle_positions.pb'), 'rb') as fixture:
+        vehicle_positions = fixture.read()
+    record('decode trip updates', lambda: gtfs_rt.decode_trip_updates(gtfs_rt.parse_feed(trip_updates)))
+    record('decode vehicle positions', lambda: gtfs_rt.decode_vehicle_positions(gtfs_rt.parse_feed(vehicle_positions)))
+    updates = gtfs_rt.decode_trip_updates(gtfs_rt.parse_feed(trip_updates))
+    record('index next stop times', lambda: gtfs_rt.index_next_stop_times(updates))
+
+    # A fresh workdir has only the subway cached so far; the import is timed against warm
+    # caches like a restarted server's, since the cold build is timed above.
+    for subdir in SYSTEMS:
+        load_system(subdir)
+    started = time.perf_counter()
+    import app
+    results['app import'] = {'seconds': time.perf_counter() - started, 'peak_bytes': None}
+    print(f"{'app import':<40} {results['app import']['seconds'] * 1000:>10.1f} ms", flush=True)
+    app.realtime_snapshots.stop()
+    for name in ('subway', 'bus', 'bus_location', 'LIRR', 'MNR', 'citibike'):
+        app.realtime_snapshots.refresh(name)
+
+    record('export_subway_schedule', lambda: app.export_subway_schedule(app.subway_API_KEY), forget_decoded)
+    record('export_bus_schedule', lambda: app.export_bus_schedule(app.bus_API_KEY), forget_decoded)
+    record('export_bus_location', lambda: app.export_bus_location(app.bus_API_KEY), forget_decoded)
+    record('export_LIRR_schedule', lambda: app.export_LIRR_schedule(app.subway_API_KEY), forget_decoded)
+    record('export_MNR_schedule', lambda: app.export_MNR_schedule(app.subway_API_KEY), forget_decoded)
+    record('citibike status refresh', lambda: app.citibike_feed.refresh(force=True))
+
+    builders = [
+        ('update_gtfs_map', 'subway', lambda system, level: app.update_gtfs_map(
+            system, system.route_ids, app.realtime_snapshots.get('subway').next_stop_times, level, None)),
+        ('update_LIRR_map', 'LIRR', lambda system, level: app.update_LIRR_map(
+            system, system.route_ids, app.realtime_snapshots.get('LIRR').next_stop_times, level, None)),
+        ('update_MNR_map', 'MNR', lambda system, level: app.update_MNR_map(
+            system, system.route_ids, app.realtime_snapshots.get('MNR').next_stop_times, level, None)),
+    ]
+    for name, subdir, build in builders:
+        system = app.static_feeds[subdir]
+        record(f'{name} (cold trace cache)', lambda: build(system, 'high'), app.route_trace_cache.clear)
+        record(f'{name} (warm trace cache)', lambda: build(system, 'high'))
+    stations = app.realtime_snapshots.get('citibike')[0]
+    record('update_citibike_map', lambda: app.update_citibike_map(stations, 'high'))
+
+    for level in ('low', 'medium', 'high'):
+        map_view = {'detail': level, 'bounds': None}
+        figure, _, layout = record(f'callback all routes, {level} detail',
+                                   lambda: call_map_callback(app, 'route-selector.value', map_view), repeat=3)
+        # Dash sends the uids, and to_json would otherwise strip them from the cached traces.
+        payload = len(plotly.io.to_json(figure, validate=False, remove_uids=False))
+        results[f'callback all routes, {level} detail']['payload_bytes'] = payload
+        target = PAYLOAD_TARGET_BYTES[level]
+        target_label = f'{target / MiB:.2f} MiB' if target else 'none'
+        print(f"{'':<40} payload {payload / MiB:.2f} MiB, target {target_label}"
+              f"{' EXCEEDED' if target and payload > target else ''}")
+        record(f'callback interval tick, {level} detail',
+               lambda: call_map_callback(app, 'interval-component.n_intervals', map_view, layout), repeat=3)
+
+    return results
+
+
+def exceeded_payloads(results):
+    return [level for level, target in PAYLOAD_TARGET_BYTES.items()
+            if target and results[f'callback all routes, {level} detail']['payload_bytes'] > target]
+
+
+def compare(results, baseline, tolerance, floor):
+    # A regression is a slowdown past tolerance that is also more than floor seconds, so a
+    # 2 ms benchmark taking 1 ms longer is not flagged.
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        change = result['seconds'] / previous['seconds'] - 1 if previous['seconds'] else 0.0
+        slower = result['seconds'] - previous['seconds']
+        flag = ' REGRESSION' if change > tolerance and slower > floor else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<40} {previous['seconds'] * 1000:>8.1f}ms {result['seconds'] * 1000:>8.1f}ms {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workdir', help='scratch directory for the synthetic feeds (default: a new temp dir)')
+    parser.add_argument('--fixtures', help='directory of recorded realtime fixtures to replay')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging')
+    parser.add_argument('--floor-ms', type=float, default=5.0, help='slowdowns up to this many ms are never flagged')
+    for size, default in SIZES.items():
+        parser.add_argument(f"--{size.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+    sizes = {size: getattr(args, size) for size in SIZES}
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='gtfs-bench-'))
+    if not os.path.isdir(os.path.join(workdir, 'GTFS')):
+        print(f'writing synthetic feeds to {workdir}', flush=True)
+        write_fixtures(workdir, **sizes)
+    fixtures = os.path.abspath(args.fixtures or os.path.join(workdir, 'realtime'))
+
+    os.chdir(workdir)
+    os.environ['REALTIME_STORE'] = ''
+    os.environ['REALTIME_ARCHIVE'] = ''
+    install_replay(fixtures)
+    results = run_benchmarks(fixtures)
+    failed = False
+    exceeded = exceeded_payloads(results)
+    if exceeded:
+        print(f"\npayload target exceeded at {', '.join(exceeded)} detail")
+        failed = True
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'sizes': sizes, 'results': results}, baseline_file, indent=2, sort_keys=True)
+        print(f'\nbaseline written to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['sizes'] != sizes:
+            print(f"\nbaseline was recorded with sizes {baseline['sizes']}; not comparing")
+        elif compare(results, baseline['results'], args.tolerance, args.floor_ms / 1000):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
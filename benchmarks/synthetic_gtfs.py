@@ -0,0 +1,206 @@
+"""Synthetic GTFS static feeds and GTFS-realtime/GBFS payloads for benchmarks.
+
+    python benchmarks/synthetic_gtfs.py /tmp/gtfs-bench --routes 200 --trips 100 --stops 5000
+
+writes GTFS/<system>/*.txt for every system the app loads, placeholder API key files and a
+realtime/ directory of FeedMessage blobs that run.py can replay.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from google.transit import gtfs_realtime_pb2
+
+SYSTEMS = ['bus_bronx', 'bus_brooklyn', 'bus_manhattan', 'bus_queens', 'bus_staten_island',
+           'subway', 'LIRR', 'MNR', 'bus_new_jersy', 'NJ_rail']
+
+# Roughly the New York area, so generated coordinates fall inside the default map view.
+LAT_RANGE = (40.50, 41.00)
+LON_RANGE = (-74.25, -73.70)
+
+
+def clock(seconds):
+    seconds = np.asarray(seconds)
+    return [f'{h:02d}:{m:02d}:{s:02d}' for h, m, s in zip(seconds // 3600, seconds // 60 % 60, seconds % 60)]
+
+
+def route_ids(routes):
+    return [f'R{route}' for route in range(routes)]
+
+
+def write_static_feed(folder, routes=50, trips=100, stops=2000, stops_per_trip=30, shape_points=200, seed=0):
+    # trips is per route; half of them run in each direction over the same stop pattern, and
+    # half of each direction on either service.
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    stop_ids = np.array([f'S{stop}' for stop in range(stops)])
+    pd.DataFrame({
+        'stop_id': stop_ids,
+        'stop_name': [f'Stop {stop}' for stop in range(stops)],
+        'stop_lat': rng.uniform(*LAT_RANGE, stops),
+        'stop_lon': rng.uniform(*LON_RANGE, stops),
+    }).to_csv(os.path.join(folder, 'stops.txt'), index=False)
+
+    pd.DataFrame({
+        'route_id': route_ids(routes),
+        'route_short_name': route_ids(routes),
+        'route_long_name': [f'Route {route} Line' for route in range(routes)],
+        'route_color': [f'{color:06X}' for color in rng.integers(0, 0xFFFFFF, routes)],
+    }).to_csv(os.path.join(folder, 'routes.txt'), index=False)
+
+    trip_route = np.repeat(np.arange(routes), trips)
+    trip_ids = np.array([f'T{route}_{trip}' for route in range(routes) for trip in range(trips)])
+    # Services A and B alternate through the week, so every service date keeps half the trips
+    # whatever day the benchmark runs on.
+    pd.DataFrame({
+        'service_id': ['A', 'B'],
+        'monday': [1, 0], 'tuesday': [0, 1], 'wednesday': [1, 0], 'thursday': [0, 1],
+        'friday': [1, 0], 'saturday': [0, 1], 'sunday': [1, 0],
+        'start_date': [20000101, 20000101],
+        'end_date': [20991231, 20991231],
+    }).to_csv(os.path.join(folder, 'calendar.txt'), index=False)
+    pd.DataFrame({
+        'service_id': ['A', 'B'],
+        'date': [20000101, 20000101],
+        'exception_type': [2, 1],
+    }).to_csv(os.path.join(folder, 'calendar_dates.txt'), index=False)
+
+    pd.DataFrame({
+        'route_id': [f'R{route}' for route in trip_route],
+        'service_id': np.tile(np.where(np.arange(trips) % 4 < 2, 'A', 'B'), routes),
+        'trip_id': trip_ids,
+        'direction_id': np.tile(np.arange(trips) % 2, routes),
+        'shape_id': [f'SH{route}' for route in trip_route],
+    }).to_csv(os.path.join(folder, 'trips.txt'), index=False)
+
+    patterns = np.stack([rng.choice(stops, stops_per_trip, replace=False) for _ in range(routes)])
+    trip_starts = rng.integers(5 * 3600, 23 * 3600, len(trip_ids))
+    sequence = np.tile(np.arange(stops_per_trip), len(trip_ids))
+    seconds = np.repeat(trip_starts, stops_per_trip) + sequence * 120
+    pd.DataFrame({
+        'trip_id': np.repeat(trip_ids, stops_per_trip),
+        'arrival_time': clock(seconds),
+        'departure_time': clock(seconds + 30),
+        'stop_id': stop_ids[patterns[trip_route].ravel()],
+        'stop_sequence': sequence + 1,
+    }).to_csv(os.path.join(folder, 'stop_times.txt'), index=False)
+
+    walk = rng.normal(0, 0.002, (routes, shape_points, 2)).cumsum(axis=1)
+    origin = np.column_stack([rng.uniform(*LAT_RANGE, routes), rng.uniform(*LON_RANGE, routes)])
+    points = origin[:, None, :] + walk
+    pd.DataFrame({
+        'shape_id': np.repeat([f'SH{route}' for route in range(routes)], shape_points),
+        'shape_pt_lat': points[:, :, 0].ravel(),
+        'shape_pt_lon': points[:, :, 1].ravel(),
+        'shape_pt_sequence': np.tile(np.arange(shape_points) + 1, routes),
+    }).to_csv(os.path.join(folder, 'shapes.txt'), index=False)
+
+
+def trip_update_feed(routes=50, trips=20, stops=2000, stops_per_trip=30, now=None, seed=0):
+    # trips is the number of active trips per route, each with stop_per_trip updates.
+    rng = np.random.default_rng(seed)
+    now = int(time.time()) if now is None else now
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    feed.header.timestamp = now
+    for route in range(routes):
+        pattern = rng.choice(stops, stops_per_trip, replace=False)
+        for trip in range(trips):
+            entity = feed.entity.add()
+            entity.id = f'{route}_{trip}'
+            entity.trip_update.trip.route_id = f'R{route}'
+            entity.trip_update.trip.trip_id = f'T{route}_{trip}'
+            start = now + int(rng.integers(-1800, 1800))
+            for position, stop in enumerate(pattern):
+                update = entity.trip_update.stop_time_update.add()
+                update.stop_id = f'S{stop}'
+                update.arrival.time = start + position * 120
+                update.departure.time = start + position * 120 + 30
+    return feed.SerializeToString()
+
+
+def vehicle_position_feed(routes=50, vehicles=10, now=None, seed=0):
+    rng = np.random.default_rng(seed)
+    now = int(time.time()) if now is None else now
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    feed.header.timestamp = now
+    for route in range(routes):
+        for vehicle in range(vehicles):
+            entity = feed.entity.add()
+            entity.id = f'V{route}_{vehicle}'
+            entity.vehicle.vehicle.id = f'V{route}_{vehicle}'
+            entity.vehicle.trip.route_id = f'R{route}'
+            entity.vehicle.trip.direction_id = vehicle % 2
+            entity.vehicle.position.latitude = rng.uniform(*LAT_RANGE)
+            entity.vehicle.position.longitude = rng.uniform(*LON_RANGE)
+    return feed.SerializeToString()
+
+
+def gbfs_feeds(stations=2000, now=None, seed=0):
+    # station_information, station_status and system_regions documents, as JSON bytes.
+    rng = np.random.default_rng(seed)
+    now = int(time.time()) if now is None else now
+    regions = [('71', 'NYC District'), ('70', 'JC District'), ('311', 'Hoboken District')]
+    region_ids = rng.choice([region_id for region_id, _ in regions], stations, p=[0.9, 0.06, 0.04])
+
+    def document(data):
+        return json.dumps({'last_updated': now, 'ttl': 60, 'data': data}).encode()
+
+    information = document({'stations': [
+        {'station_id': str(station), 'name': f'Station {station}', 'lat': float(lat), 'lon': float(lon),
+         'capacity': 30, 'region_id': str(region_id)}
+        for station, lat, lon, region_id in zip(range(stations), rng.uniform(*LAT_RANGE, stations),
+                                                rng.uniform(*LON_RANGE, stations), region_ids)]})
+    status = document({'stations': [
+        {'station_id': str(station), 'num_docks_available': int(docks), 'num_bikes_disabled': 0,
+         'num_ebikes_available': int(ebikes), 'num_bikes_available': int(30 - docks), 'num_docks_disabled': 0,
+         'is_renting': 1, 'is_returning': 1, 'last_reported': now - int(age), 'is_installed': 1}
+        for station, docks, ebikes, age in zip(range(stations), rng.integers(0, 30, stations),
+                                               rng.integers(0, 5, stations), rng.integers(0, 600, stations))]})
+    system_regions = document({'regions': [{'region_id': region_id, 'name': name} for region_id, name in regions]})
+    return information, status, system_regions
+
+
+def write_fixtures(root, routes=50, trips=100, stops=2000, stops_per_trip=30, shape_points=200,
+                   active_trips=20, vehicles=10, stations=2000):
+    for seed, system in enumerate(SYSTEMS):
+        write_static_feed(os.path.join(root, 'GTFS', system), routes, trips, stops, stops_per_trip, shape_points, seed)
+    for name in ('subway_API_Key.txt', 'bus_API_Key.txt'):
+        with open(os.path.join(root, 'GTFS', name), 'w') as key_file:
+            key_file.write('benchmark')
+
+    realtime = os.path.join(root, 'realtime')
+    os.makedirs(realtime, exist_ok=True)
+    blobs = {
+        'trip_updates.pb': trip_update_feed(routes, active_trips, stops, stops_per_trip),
+        'vehicle_positions.pb': vehicle_position_feed(routes, vehicles),
+    }
+    blobs.update(zip(['station_information.json', 'station_status.json', 'system_regions.json'], gbfs_feeds(stations)))
+    for name, blob in blobs.items():
+        with open(os.path.join(realtime, name), 'wb') as fixture:
+            fixture.write(blob)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--routes', type=int, default=50)
+    parser.add_argument('--trips', type=int, default=100, help='scheduled trips per route')
+    parser.add_argument('--stops', type=int, default=2000)
+    parser.add_argument('--stops-per-trip', type=int, default=30)
+    parser.add_argument('--shape-points', type=int, default=200)
+    parser.add_argument('--active-trips', type=int, default=20, help='realtime trips per route')
+    parser.add_argument('--vehicles', type=int, default=10, help='vehicles per route')
+    parser.add_argument('--stations', type=int, default=2000)
+    args = parser.parse_args()
+    write_fixtures(args.root, args.routes, args.trips, args.stops, args.stops_per_trip, args.shape_points,
+                   args.active_trips, args.vehicles, args.stations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Per-worker memory growth from loading static GTFS systems.
+
+Starts N worker processes that load the same systems at the same time and reports how much
+each one grows, in the way a set of server workers on one host would. Run from the
+repository root:
+
+    python benchmarks/worker_rss.py --workers 4 subway bus_manhattan
+
+"mapped" loads through the Arrow cache (the app's path); "private" parses the GTFS text
+files in every worker, which is what each worker paid before the tables were shared.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gtfs_static import StaticFeed, build_system_tables, load_system  # noqa: E402
+
+MiB = 1024 * 1024
+
+
+def memory_counters():
+    # Rss counts shared pages in full, Pss splits them between the processes mapping them and
+    # Private is what this process alone holds.
+    counters = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                counters[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {
+        'rss': counters['Rss'],
+        'pss': counters['Pss'],
+        'private': counters['Private_Clean'] + counters['Private_Dirty'],
+    }
+
+
+def load(mode, subdir):
+    if mode == 'mapped':
+        return load_system(subdir)
+    return StaticFeed(subdir, **build_system_tables(os.path.join('GTFS', subdir)))
+
+
+def worker(mode, systems, loaded, measured, results):
+    before = memory_counters()
+    feeds = [load(mode, subdir) for subdir in systems]
+    # Measure only once every worker holds its systems, so Pss reflects the sharing.
+    loaded.wait()
+    after = memory_counters()
+    results.put({name: after[name] - before[name] for name in after})
+    measured.wait()
+    del feeds
+
+
+def run(mode, systems, workers):
+    context = multiprocessing.get_context('spawn')
+    loaded = context.Barrier(workers)
+    measured = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, systems, loaded, measured, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    growth = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('systems', nargs='+', help='subdirectories of GTFS/ to load')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=['mapped', 'private'], choices=['mapped', 'private'])
+    args = parser.parse_args()
+
+    # Build the caches up front so the mapped run measures loading, not the one-off build.
+    for subdir in args.systems:
+        load_system(subdir)
+
+    print(f"{'mode':<8} {'workers':>7} {'rss MiB':>9} {'pss MiB':>9} {'private MiB':>12}")
+    for mode in args.modes:
+        growth = run(mode, args.systems, args.workers)
+        mean = {name: sum(g[name] for g in growth) / len(growth) / MiB for name in growth[0]}
+        print(f"{mode:<8} {args.workers:>7} {mean['rss']:>9.1f} {mean['pss']:>9.1f} {mean['private']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import time
+
+# Wall-clock source for anything that compares feed timestamps with "now" or "today".
+# Replay mode swaps in the recording's clock so those comparisons match the recorded day.
+_now = time.time
+
+
+def now():
+    return _now()
+
+
+def set_clock(func):
+    global _now
+    _now = time.time if func is None else func
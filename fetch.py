@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) seconds; an upstream that stalls must not hold a poller thread forever.
+DEFAULT_TIMEOUT = (5, 20)
+MAX_WORKERS = 16
+
+FetchResult = namedtuple('FetchResult', ['url', 'content', 'error', 'elapsed'])
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='fetch')
+_session = None
+_session_lock = threading.Lock()
+# url -> (ETag, Last-Modified) of the last successful response, for conditional requests.
+_validators = {}
+# Set by set_source() to answer every request locally (replay mode) instead of over HTTP.
+_source = None
+# Set by set_recorder() to keep every response body under <directory>/<feed>/<epoch ms>.bin.
+_record_directory = None
+
+metrics.describe('feed_fetch_seconds', 'histogram', 'Upstream feed request latency.')
+metrics.describe('feed_fetch_bytes_total', 'counter', 'Bytes received from upstream feeds.')
+metrics.describe('feed_fetch_total', 'counter', 'Upstream feed requests by outcome.')
+
+
+def feed_label(url):
+    # Host and path only: some feeds carry the API key in the query string.
+    parts = urlsplit(url)
+    return f'{parts.netloc}{parts.path}'
+
+
+def recording_folder(directory, url):
+    return os.path.join(directory, quote(feed_label(url), safe=''))
+
+
+def set_source(source):
+    # source.fetch(url, conditional) returns a body, or None for "not modified"; None restores HTTP.
+    global _source
+    _source = source
+
+
+def set_recorder(directory):
+    global _record_directory
+    _record_directory = directory
+
+
+def record(url, content):
+    folder = recording_folder(_record_directory, url)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'{int(time.time() * 1000)}.bin')
+    try:
+        with open(f'{path}.tmp', 'wb') as recording:
+            recording.write(content)
+        os.replace(f'{path}.tmp', path)
+    except OSError:
+        logger.exception('recording %s failed', feed_label(url))
+
+
+def get_session():
+    # One session for the process so every host keeps a pool of keep-alive connections.
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=MAX_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def fetch(url, headers=None, timeout=DEFAULT_TIMEOUT, conditional=False):
+    # With conditional=True the request carries the validators from the last response and
+    # None is returned when the server answers 304 Not Modified.
+    if _source is not None:
+        return _source.fetch(url, conditional)
+    request_headers = dict(headers or {})
+    if conditional and url in _validators:
+        etag, last_modified = _validators[url]
+        if etag:
+            request_headers['If-None-Match'] = etag
+        if last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+
+    feed = feed_label(url)
+    started = time.perf_counter()
+    try:
+        response = get_session().get(url, headers=request_headers, timeout=timeout)
+        metrics.observe('feed_fetch_seconds', time.perf_counter() - started, feed=feed)
+        if conditional and response.status_code == 304:
+            metrics.inc('feed_fetch_total', feed=feed, outcome='not_modified')
+            return None
+        response.raise_for_status()
+    except requests.RequestException:
+        metrics.inc('feed_fetch_total', feed=feed, outcome='error')
+        raise
+    metrics.inc('feed_fetch_total', feed=feed, outcome='ok')
+    metrics.inc('feed_fetch_bytes_total', len(response.content), feed=feed)
+
+    _validators[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    if _record_directory is not None:
+        record(url, response.content)
+    return response.content
+
+
+def _fetch_result(url, headers, timeout, conditional):
+    started = time.monotonic()
+    try:
+        content = fetch(url, headers=headers, timeout=timeout, conditional=conditional)
+    except requests.RequestException as error:
+        # The error's text carries the full URL, which for some feeds includes the API key.
+        logger.warning('fetching %s failed: %s', feed_label(url), type(error).__name__)
+        return FetchResult(url, None, error, time.monotonic() - started)
+    return FetchResult(url, content, None, time.monotonic() - started)
+
+
+def fetch_all(urls, headers=None, timeout=DEFAULT_TIMEOUT, conditional=False):
+    # Results come back in the order of urls; a failed feed has content None and its error
+    # set, so callers can still use whatever did arrive. A 304 has content and error None.
+    # conditional is one flag for every url or a list with a flag per url.
+    if isinstance(conditional, bool):
+        conditional = [conditional] * len(urls)
+    futures = [_executor.submit(_fetch_result, url, headers, timeout, url_conditional)
+               for url, url_conditional in zip(urls, conditional)]
+    return [future.result() for future in futures]
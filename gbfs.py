@@ -0,0 +1,100 @@
+import json
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import clock
+from fetch import fetch, fetch_all
+from map_detail import GridIndex
+
+STATUS_COLUMNS = ['num_docks_available', 'num_bikes_disabled', 'num_ebikes_available', 'num_bikes_available',
+                  'num_docks_disabled', 'is_renting', 'is_returning', 'last_reported', 'is_installed']
+
+# Station information and regions change when stations are added or moved, so they are only
+# re-requested this often (conditionally) regardless of the short ttl they advertise.
+INFORMATION_MAX_AGE = 6 * 3600
+
+StationSnapshot = namedtuple('StationSnapshot', ['stations', 'index'])
+
+
+def feed_data(content):
+    document = json.loads(content)
+    return document['data'], document.get('last_updated', 0), document.get('ttl', 0)
+
+
+class StationFeed:
+    # One GBFS system: station information and regions are kept for hours and turned into a
+    # station frame and spatial index once; station_status is fetched only after its own
+    # last_updated + ttl has passed and is written into a copy of that frame by position.
+    def __init__(self, information_url, status_url, regions_url, information_max_age=INFORMATION_MAX_AGE):
+        self.information_url = information_url
+        self.status_url = status_url
+        self.regions_url = regions_url
+        self.information_max_age = information_max_age
+        self._lock = threading.Lock()
+        self._stations = None
+        self._station_positions = None
+        self._index = None
+        self._information_fetched_at = None
+        self._status_due_at = 0
+        self.snapshot = None
+
+    def refresh(self, force=False):
+        # Returns the current StationSnapshot; the same object comes back when nothing changed.
+        with self._lock:
+            now = clock.now()
+            information_changed = False
+            if self._information_fetched_at is None or now - self._information_fetched_at >= self.information_max_age:
+                information_changed = self._refresh_information()
+                self._information_fetched_at = now
+
+            if information_changed or force or self.snapshot is None or now >= self._status_due_at:
+                content = fetch(self.status_url, conditional=not (information_changed or self.snapshot is None))
+                if content is not None:
+                    status, last_updated, ttl = feed_data(content)
+                    self._status_due_at = max(last_updated + ttl, now + 1)
+                    self.snapshot = StationSnapshot(self._apply_status(status['stations']), self._index)
+            return self.snapshot
+
+    def _refresh_information(self):
+        results = fetch_all([self.information_url, self.regions_url], conditional=self._stations is not None)
+        for result in results:
+            if result.error is not None:
+                raise result.error
+        if all(result.content is None for result in results):
+            return False
+        # A 304 on one of the two still needs its body, so both are fetched in full.
+        if any(result.content is None for result in results):
+            results = fetch_all([self.information_url, self.regions_url])
+            for result in results:
+                if result.error is not None:
+                    raise result.error
+
+        (information, _, _), (regions, _, _) = [feed_data(result.content) for result in results]
+        stations = pd.DataFrame(information['stations'])[['station_id', 'name', 'lat', 'lon', 'capacity', 'region_id']]
+        region_names = pd.DataFrame(regions['regions']).set_index('region_id')['name']
+        stations['region_name'] = region_names.reindex(stations['region_id'].astype(str)).values
+        self._stations = stations
+        self._station_positions = pd.Index(stations['station_id'].astype(str))
+        self._index = GridIndex(stations['lat'].values, stations['lon'].values)
+        return True
+
+    def _apply_status(self, status_stations):
+        # Stations missing from the status document get 0 in every status column and reporting
+        # False; they are not shown or archived, so those zeros are never read as real counts.
+        status = pd.DataFrame(status_stations)
+        positions = self._station_positions.get_indexer(status['station_id'].astype(str))
+        known = positions >= 0
+        positions = positions[known]
+        stations = self._stations.copy(deep=False)
+        for column in STATUS_COLUMNS:
+            values = np.zeros(len(stations), dtype='int64')
+            if column in status:
+                values[positions] = status[column].fillna(0).astype('int64').values[known]
+            stations[column] = values
+        reporting = np.zeros(len(stations), dtype=bool)
+        reporting[positions] = True
+        stations['reporting'] = reporting
+        return stations
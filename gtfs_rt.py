@@ -0,0 +1,192 @@
+from datetime import datetime
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from google.transit import gtfs_realtime_pb2
+
+import clock
+import metrics
+from fetch import feed_label
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+TripUpdateSnapshot = namedtuple('TripUpdateSnapshot', ['updates', 'next_stop_times'])
+
+# key -> (FeedHeader.timestamp, decoded frame) of the last feed body that was decoded.
+_decoded = {}
+# key -> (source frames, combined frame) for feeds assembled from several URLs.
+_combined = {}
+
+metrics.describe('feed_decode_seconds', 'histogram', 'Protobuf parsing and decoding time per feed body.')
+metrics.describe('feed_entities', 'gauge', 'Entities in the last decoded feed body.')
+metrics.describe('feed_unchanged_total', 'counter', 'Feed bodies skipped because the header timestamp repeated.')
+
+
+def parse_feed(content):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+    return feed
+
+
+def has_decoded(key):
+    # Callers request a feed conditionally only once a body of it has been decoded: a 304
+    # before that, or after the body failed to decode, would leave nothing to return.
+    return key in _decoded
+
+
+def decode_if_changed(key, content, decode):
+    # Returns the previous frame object itself when the server answered 304 (content None)
+    # or the feed header carries the same timestamp, so unchanged feeds skip decoding and
+    # downstream consumers can tell by identity that nothing moved.
+    previous = _decoded.get(key)
+    if content is None:
+        return previous[1] if previous is not None else None
+
+    label = feed_label(key)
+    started = time.perf_counter()
+    feed = parse_feed(content)
+    timestamp = feed.header.timestamp
+    if previous is not None and timestamp and timestamp == previous[0]:
+        metrics.inc('feed_unchanged_total', feed=label)
+        return previous[1]
+
+    frame = decode(feed)
+    metrics.observe('feed_decode_seconds', time.perf_counter() - started, feed=label)
+    metrics.set_gauge('feed_entities', len(feed.entity), feed=label)
+    _decoded[key] = (timestamp, frame)
+    return frame
+
+
+def combine_decoded(key, frames):
+    previous = _combined.get(key)
+    if previous is not None and len(previous[0]) == len(frames) and all(a is b for a, b in zip(previous[0], frames)):
+        return previous[1]
+
+    combined = pd.concat(frames, ignore_index=True) if frames else decode_trip_updates()
+    for column in combined.columns:
+        if combined[column].dtype == object:
+            combined[column] = combined[column].astype('category')
+    _combined[key] = (frames, combined)
+    return combined
+
+
+def repeat_categorical(values, counts):
+    categorical = pd.Categorical(values)
+    return pd.Categorical.from_codes(np.repeat(categorical.codes, counts), categorical.categories)
+
+
+def decode_trip_updates(*feeds):
+    # One row per stop_time_update. Ids stay categorical and times stay int64 epochs;
+    # turning them into strings is left to whoever renders the handful of rows on screen.
+    route_ids, trip_ids, counts = [], [], []
+    stop_ids, arrivals, departures = [], [], []
+
+    for feed in feeds:
+        for entity in feed.entity:
+            if not entity.HasField('trip_update'):
+                continue
+            trip_update = entity.trip_update
+            updates = trip_update.stop_time_update
+            route_ids.append(trip_update.trip.route_id)
+            trip_ids.append(trip_update.trip.trip_id)
+            counts.append(len(updates))
+            stop_ids.extend([update.stop_id for update in updates])
+            arrivals.extend([update.arrival.time for update in updates])
+            departures.extend([update.departure.time for update in updates])
+
+    counts = np.asarray(counts, dtype='int64')
+    return pd.DataFrame({
+        'route_id': repeat_categorical(route_ids, counts),
+        'trip_id': repeat_categorical(trip_ids, counts),
+        'stop_id': pd.Categorical(stop_ids),
+        'arrival': np.asarray(arrivals, dtype='int64'),
+        'departure': np.asarray(departures, dtype='int64'),
+    })
+
+
+def decode_vehicle_positions(*feeds):
+    vehicle_ids, route_ids, direction_ids = [], [], []
+    latitudes, longitudes = [], []
+
+    for feed in feeds:
+        for entity in feed.entity:
+            if not entity.HasField('vehicle'):
+                continue
+            vehicle = entity.vehicle
+            trip = vehicle.trip
+            vehicle_ids.append(vehicle.vehicle.id)
+            route_ids.append(trip.route_id if trip.HasField('route_id') else "")
+            direction_ids.append(trip.direction_id if trip.HasField('direction_id') else None)
+            latitudes.append(vehicle.position.latitude)
+            longitudes.append(vehicle.position.longitude)
+
+    return pd.DataFrame({
+        'vehicle_id': pd.array(vehicle_ids, dtype='string'),
+        'route_id': pd.Categorical(route_ids),
+        'direction_id': pd.array(direction_ids, dtype='Int8'),
+        'latitude': np.asarray(latitudes, dtype='float64'),
+        'longitude': np.asarray(longitudes, dtype='float64'),
+    })
+
+
+def start_of_today():
+    return int(time.mktime(datetime.fromtimestamp(clock.now()).date().timetuple()))
+
+
+def format_epoch(epoch):
+    return datetime.fromtimestamp(epoch).strftime(TIME_FORMAT)
+
+
+def index_next_stop_times(updates, now=None):
+    # Per (route_id, stop_id) keep the soonest update that has not passed yet, or the most
+    # recent one when every update for that stop is already in the past.
+    now = int(clock.now()) if now is None else now
+    latest = np.maximum(updates['arrival'].values, updates['departure'].values)
+    passed = latest < now
+    frame = pd.DataFrame({
+        'route_id': updates['route_id'].astype(str).values,
+        'stop_id': updates['stop_id'].astype(str).values,
+        'arrival': updates['arrival'].values,
+        'departure': updates['departure'].values,
+        'order': np.where(passed, -latest, latest),
+        'passed': passed,
+    })
+    frame = frame.sort_values(['route_id', 'stop_id', 'passed', 'order'], kind='stable')
+    frame = frame.drop_duplicates(['route_id', 'stop_id'])
+    return {route_id: rows.set_index('stop_id')[['arrival', 'departure']]
+            for route_id, rows in frame.groupby('route_id', sort=False)}
+
+
+def trip_update_snapshot(updates):
+    return TripUpdateSnapshot(updates, index_next_stop_times(updates))
+
+
+def empty_trip_update_snapshot():
+    return trip_update_snapshot(decode_trip_updates())
+
+
+def format_epochs(epochs, stale=None):
+    # Realtime times repeat a lot across stops, so format each distinct epoch only once.
+    unique, inverse = np.unique(np.asarray(epochs, dtype='int64'), return_inverse=True)
+    labels = np.array([format_epoch(epoch) for epoch in unique], dtype=object)[inverse]
+    if stale is not None:
+        labels[stale] = 'N/A'
+    return labels
+
+
+def join_stop_times(stops, route_stop_times):
+    # Attach arrival/departure display strings to a route's stop list. A time from before
+    # today is shown as N/A, as is a departure when only that one is stale.
+    if route_stop_times is None:
+        route_stop_times = pd.DataFrame({'arrival': pd.Series(dtype='int64'), 'departure': pd.Series(dtype='int64')},
+                                        index=pd.Index([], name='stop_id'))
+    joined = stops.merge(route_stop_times, left_on='stop_id', right_index=True, how='left').reset_index(drop=True)
+    today = start_of_today()
+    arrival = joined['arrival'].fillna(0).astype('int64').values
+    departure = joined['departure'].fillna(0).astype('int64').values
+    arrival_stale = arrival < today
+    joined['arrival_time'] = format_epochs(arrival, arrival_stale)
+    joined['departure_time'] = format_epochs(departure, (~arrival_stale & (departure < today)) | (departure == 0))
+    return joined.drop(columns=['arrival', 'departure'])
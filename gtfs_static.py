@@ -0,0 +1,455 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import clock
+from caches import SizedLRUCache
+
+GTFS_DIR = 'GTFS'
+CACHE_DIR = os.path.join(GTFS_DIR, '.cache')
+
+# Bump whenever the layout of the cached tables changes so old files are ignored.
+CACHE_VERSION = 6
+
+TABLES = ('stops', 'routes', 'trips', 'stop_times', 'shapes')
+CALENDAR_TABLES = ('calendar', 'calendar_dates')
+# The tables cut down to the trips running on the service dates; stops and routes are shared.
+SERVICE_TABLES = ('trips', 'stop_times', 'shapes')
+
+ROUTE_COLUMNS = ['route_id', 'route_long_name', 'route_color']
+STOP_COLUMNS = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon']
+TRIP_COLUMNS = ['route_id', 'service_id', 'trip_id', 'direction_id', 'shape_id']
+STOP_TIME_COLUMNS = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']
+SHAPE_COLUMNS = ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+CALENDAR_COLUMNS = ['service_id'] + WEEKDAYS + ['start_date', 'end_date']
+CALENDAR_DATE_COLUMNS = ['service_id', 'date', 'exception_type']
+
+RoutePattern = namedtuple('RoutePattern', ['route_id', 'direction_id', 'trip_id', 'stops', 'shape_lat', 'shape_lon'])
+
+
+class StaticFeed:
+    def __init__(self, name, stops, routes, trips, stop_times, shapes, key=None, service=None):
+        self.name = name
+        # Identifies this exact build of the data, for caches derived from it.
+        self.key = key or name
+        # What the trips were cut down to (see select_services), None when the feed has no calendar.
+        self.service = service
+        self.service_date = date.fromisoformat(service['service_date']) if service is not None else None
+        self.stops = stops
+        self.routes = routes
+        self.trips = trips
+        self.stop_times = stop_times
+        self.shapes = shapes
+
+        # stop_times is sorted by (route, trip, stop_sequence) at build time, so each route
+        # and each trip owns one contiguous block of rows.
+        trip_codes = stop_times['trip_code'].values
+        self.trip_offsets = np.searchsorted(trip_codes, np.arange(len(trips) + 1))
+        self.route_offsets = np.searchsorted(trips['route_code'].values[trip_codes], np.arange(len(routes) + 1))
+
+        served = np.flatnonzero(np.diff(self.route_offsets))
+        self.route_ids = routes['route_id'].values[served]
+        self._route_codes = pd.Index(routes['route_id'])
+        self.patterns, self.primary_patterns = build_route_patterns(self)
+
+    def route_code(self, route_id):
+        return self._route_codes.get_loc(route_id)
+
+    def route_attribute(self, route_id, column):
+        return self.routes[column].iat[self.route_code(route_id)]
+
+    def route_pattern(self, route_id, direction_id=None):
+        if direction_id is None:
+            return self.primary_patterns[route_id]
+        return self.patterns[(route_id, direction_id)]
+
+    def select_routes(self, route_ids):
+        return self.route_ids[np.isin(self.route_ids, list(route_ids))]
+
+    def trip_rows(self, trip_code):
+        return self.stop_times.iloc[self.trip_offsets[trip_code]:self.trip_offsets[trip_code + 1]]
+
+    def memory_bytes(self):
+        return sum(int(table.memory_usage(deep=True).sum()) for table in self.tables().values())
+
+    def tables(self):
+        return {table: getattr(self, table) for table in TABLES}
+
+
+def build_route_patterns(feed):
+    # One representative trip per (route, direction): the one visiting the most stops,
+    # ties broken by trip order so the choice is stable across reloads.
+    trips = feed.trips
+    candidates = pd.DataFrame({
+        'route_code': trips['route_code'].values,
+        'direction_id': trips['direction_id'].values,
+        'n_stops': np.diff(feed.trip_offsets),
+        'trip_code': np.arange(len(trips)),
+    })
+    candidates = candidates[(candidates['n_stops'] > 0) & (candidates['route_code'] >= 0)]
+    candidates = candidates.sort_values(['route_code', 'n_stops', 'trip_code'], ascending=[True, False, True])
+    representatives = candidates.drop_duplicates(['route_code', 'direction_id'])
+
+    shape_rows = feed.shapes.groupby('shape_id', observed=True).indices if len(feed.shapes) else {}
+
+    patterns = {}
+    primary_patterns = {}
+    for route_code, direction_id, trip_code in representatives[['route_code', 'direction_id', 'trip_code']].itertuples(index=False):
+        route_id = feed.routes['route_id'].iat[route_code]
+        pattern_rows = feed.trip_rows(trip_code)
+        stops = feed.stops.reindex(pattern_rows['stop_code'].values)
+        stops = pd.DataFrame({
+            'stop_id': stops['stop_id'].values,
+            'stop_name': stops['stop_name'].values,
+            'stop_lat': stops['stop_lat'].values,
+            'stop_lon': stops['stop_lon'].values,
+            'stop_sequence': pattern_rows['stop_sequence'].values,
+        })
+
+        shape_lat = shape_lon = None
+        shape_id = trips['shape_id'].iat[trip_code]
+        if shape_id in shape_rows:
+            shape = feed.shapes.iloc[shape_rows[shape_id]]
+            shape_lat = shape['shape_pt_lat'].values
+            shape_lon = shape['shape_pt_lon'].values
+
+        pattern = RoutePattern(route_id, int(direction_id), trips['trip_id'].iat[trip_code], stops, shape_lat, shape_lon)
+        patterns[(route_id, int(direction_id))] = pattern
+        # Candidates are ordered longest first within a route, so the first direction seen is primary.
+        primary_patterns.setdefault(route_id, pattern)
+
+    return patterns, primary_patterns
+
+
+def feed_fingerprint(folder_path):
+    digest = hashlib.sha1(f'v{CACHE_VERSION}'.encode())
+    for path in sorted(glob.glob(os.path.join(folder_path, '*.txt'))):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:16]
+
+
+def read_table(folder_path, filename, columns, dtype):
+    return pd.read_csv(os.path.join(folder_path, filename),
+                       usecols=lambda column: column in columns, dtype=dtype)
+
+
+def codes_for(values, index):
+    # Map a categorical column onto row positions of a lookup table, -1 when absent.
+    positions = pd.Index(index).get_indexer(values.cat.categories)
+    return np.append(positions, -1)[values.cat.codes.values].astype('int32')
+
+
+def seconds_since_midnight(values):
+    # GTFS times may run past 24:00:00; parse each distinct string once.
+    parts = values.cat.categories.to_series().str.strip().str.split(':', expand=True).astype('int32')
+    seconds = (parts[0] * 3600 + parts[1] * 60 + parts[2]).values
+    return np.append(seconds, -1)[values.cat.codes.values].astype('int32')
+
+
+def build_system_tables(folder_path):
+    routes = read_table(folder_path, 'routes.txt', ROUTE_COLUMNS,
+                        {'route_id': str, 'route_long_name': str, 'route_color': str})
+    stops = read_table(folder_path, 'stops.txt', STOP_COLUMNS, {'stop_id': str, 'stop_name': str})
+    trips = read_table(folder_path, 'trips.txt', TRIP_COLUMNS,
+                       {'route_id': 'category', 'service_id': 'category', 'trip_id': str, 'shape_id': 'category'})
+    stop_times = read_table(folder_path, 'stop_times.txt', STOP_TIME_COLUMNS,
+                            {'trip_id': 'category', 'stop_id': 'category',
+                             'arrival_time': 'category', 'departure_time': 'category'})
+
+    routes = routes.reindex(columns=ROUTE_COLUMNS).reset_index(drop=True)
+    routes['color'] = "#" + routes['route_color'].fillna('000000').astype(str)
+    stops = stops.reindex(columns=STOP_COLUMNS).reset_index(drop=True)
+
+    trips = trips.reset_index(drop=True)
+    trips = pd.DataFrame({
+        'trip_id': trips['trip_id'],
+        'route_code': codes_for(trips['route_id'], routes['route_id']),
+        'service_id': trips['service_id'],
+        'direction_id': trips.get('direction_id', pd.Series(-1, index=trips.index)).fillna(-1).astype('int8'),
+        'shape_id': trips['shape_id'] if 'shape_id' in trips else pd.Categorical([None] * len(trips)),
+    })
+    # Number trips route by route so sorting stop_times by trip also groups it by route.
+    trips = trips.sort_values('route_code', kind='stable').reset_index(drop=True)
+
+    stop_times = pd.DataFrame({
+        'trip_code': codes_for(stop_times['trip_id'], trips['trip_id']),
+        'stop_code': codes_for(stop_times['stop_id'], stops['stop_id']),
+        'stop_sequence': stop_times['stop_sequence'].astype('int32'),
+        'arrival_secs': seconds_since_midnight(stop_times['arrival_time']),
+        'departure_secs': seconds_since_midnight(stop_times['departure_time']),
+    })
+    stop_times = stop_times[stop_times['trip_code'] >= 0]
+    stop_times = stop_times.sort_values(['trip_code', 'stop_sequence'], kind='stable').reset_index(drop=True)
+
+    if os.path.exists(os.path.join(folder_path, 'shapes.txt')):
+        shapes = read_table(folder_path, 'shapes.txt', SHAPE_COLUMNS, {'shape_id': 'category'})
+        shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence'], kind='stable')
+        shapes = shapes[['shape_id', 'shape_pt_lat', 'shape_pt_lon']].reset_index(drop=True)
+    else:
+        shapes = pd.DataFrame({'shape_id': pd.Categorical([]), 'shape_pt_lat': [], 'shape_pt_lon': []})
+
+    return {'stops': stops, 'routes': routes, 'trips': trips, 'stop_times': stop_times, 'shapes': shapes}
+
+
+def build_calendar_tables(folder_path):
+    # calendar.txt and calendar_dates.txt with dates as YYYYMMDD integers; a feed may have
+    # either one or neither, and a missing file becomes an empty table.
+    if os.path.exists(os.path.join(folder_path, 'calendar.txt')):
+        calendar = read_table(folder_path, 'calendar.txt', CALENDAR_COLUMNS, {'service_id': str})
+    else:
+        calendar = pd.DataFrame(columns=CALENDAR_COLUMNS)
+    calendar = pd.DataFrame({
+        'service_id': calendar['service_id'].astype(str).values,
+        **{column: calendar[column].fillna(0).astype('int8').values for column in WEEKDAYS},
+        'start_date': calendar['start_date'].fillna(0).astype('int32').values,
+        'end_date': calendar['end_date'].fillna(0).astype('int32').values,
+    })
+
+    if os.path.exists(os.path.join(folder_path, 'calendar_dates.txt')):
+        calendar_dates = read_table(folder_path, 'calendar_dates.txt', CALENDAR_DATE_COLUMNS, {'service_id': str})
+    else:
+        calendar_dates = pd.DataFrame(columns=CALENDAR_DATE_COLUMNS)
+    calendar_dates = pd.DataFrame({
+        'service_id': calendar_dates['service_id'].astype(str).values,
+        'date': calendar_dates['date'].fillna(0).astype('int32').values,
+        'exception_type': calendar_dates['exception_type'].fillna(0).astype('int8').values,
+    })
+    return {'calendar': calendar, 'calendar_dates': calendar_dates}
+
+
+def active_services(calendar, calendar_dates, day):
+    # service_ids running on day: the weekly pattern in calendar when day is inside its date
+    # range, plus calendar_dates additions (exception_type 1) and minus removals (2).
+    number = int(day.strftime('%Y%m%d'))
+    weekly = calendar[(calendar['start_date'].values <= number) & (calendar['end_date'].values >= number)
+                      & (calendar[WEEKDAYS[day.weekday()]].values == 1)]
+    exceptions = calendar_dates[calendar_dates['date'].values == number]
+    services = set(weekly['service_id']) | set(exceptions.loc[exceptions['exception_type'].values == 1, 'service_id'])
+    return services - set(exceptions.loc[exceptions['exception_type'].values == 2, 'service_id'])
+
+
+def current_service_date():
+    return datetime.fromtimestamp(clock.now()).date()
+
+
+def select_services(tables, services):
+    # trips, stop_times and shapes reduced to trips of the given services, with trip codes
+    # renumbered in the same order so stop_times stays grouped by route and trip.
+    trips, stop_times, shapes = tables['trips'], tables['stop_times'], tables['shapes']
+    keep = trips['service_id'].astype(str).isin(services).values
+    trip_codes = np.where(keep, np.cumsum(keep) - 1, -1).astype('int32')
+
+    kept_rows = keep[stop_times['trip_code'].values]
+    stop_times = stop_times[kept_rows].reset_index(drop=True)
+    stop_times['trip_code'] = trip_codes[stop_times['trip_code'].values]
+    trips = trips[keep].reset_index(drop=True)
+    shapes = shapes[shapes['shape_id'].isin(trips['shape_id'].dropna().unique()).values].reset_index(drop=True)
+    return {'trips': trips, 'stop_times': stop_times, 'shapes': shapes}
+
+
+def tables_bytes(tables):
+    return sum(int(table.memory_usage(deep=True).sum()) for table in tables.values())
+
+
+def write_cache(tables, cache_path, subdir, metadata=None):
+    # Several server workers may build the same cache at once on a cold start; each writes
+    # its own temporary directory and the first one to rename it into place wins.
+    tmp_path = f'{cache_path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, df in tables.items():
+        # Uncompressed Arrow IPC in a single record batch, so each column maps back as one
+        # contiguous buffer; a chunked column would be concatenated into private memory.
+        feather.write_feather(df, os.path.join(tmp_path, f'{name}.arrow'), compression='uncompressed',
+                              chunksize=max(len(df), 1))
+    if metadata is not None:
+        with open(os.path.join(tmp_path, 'metadata.json'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        if not os.path.isdir(cache_path):
+            raise
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+
+    for stale in glob.glob(os.path.join(os.path.dirname(cache_path), f'{subdir}-*')):
+        if stale != cache_path and not stale.startswith(f'{cache_path}.tmp-'):
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+def read_cache(cache_path, names=TABLES):
+    # Every column is a zero-copy view of the mapped file, so all processes on the host that
+    # load a system share the same page-cache pages instead of holding private copies. String
+    # columns only stay in the mapping because pandas 3 keeps them Arrow-backed; older pandas
+    # would copy them into object arrays in each worker, hence the pin in requirements.txt.
+    tables = {}
+    for name in names:
+        with pa.memory_map(os.path.join(cache_path, f'{name}.arrow'), 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        tables[name] = table.to_pandas(split_blocks=True)
+    return tables
+
+
+def cache_location(subdir):
+    fingerprint = feed_fingerprint(os.path.join(GTFS_DIR, subdir))
+    return fingerprint, os.path.join(CACHE_DIR, f'{subdir}-{fingerprint}')
+
+
+def build_cache(subdir):
+    # The full tables of every trip, built from the feed's text files unless already cached.
+    fingerprint, cache_path = cache_location(subdir)
+    if not os.path.isdir(cache_path):
+        folder_path = os.path.join(GTFS_DIR, subdir)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_cache({**build_system_tables(folder_path), **build_calendar_tables(folder_path)}, cache_path, subdir)
+    return fingerprint, cache_path
+
+
+def read_metadata(cache_path):
+    with open(os.path.join(cache_path, 'metadata.json')) as metadata_file:
+        return json.load(metadata_file)
+
+
+def write_service_cache(calendar, cache_path, service_path, service_date, service_days):
+    days = [service_date + timedelta(days=offset) for offset in range(service_days)]
+    services = set().union(*(active_services(calendar['calendar'], calendar['calendar_dates'], day) for day in days))
+
+    tables = read_cache(cache_path, SERVICE_TABLES)
+    selected = select_services(tables, services)
+    metadata = {
+        'service_date': service_date.isoformat(),
+        'service_days': service_days,
+        'services': sorted(services),
+        'trips': len(selected['trips']),
+        'all_trips': len(tables['trips']),
+        'bytes': tables_bytes(selected),
+        'all_bytes': tables_bytes(tables),
+    }
+    write_cache(selected, service_path, 'service', metadata)
+
+
+def load_system(subdir, service_date=None, service_days=1):
+    # Only trips running on service_date (today by default) and the service_days - 1 days
+    # after it are loaded; each date's cut is cached next to the full tables. A feed without
+    # calendar.txt or calendar_dates.txt is loaded whole.
+    fingerprint, cache_path = build_cache(subdir)
+    calendar = read_cache(cache_path, CALENDAR_TABLES)
+    if calendar['calendar'].empty and calendar['calendar_dates'].empty:
+        return StaticFeed(subdir, **read_cache(cache_path), key=f'{subdir}-{fingerprint}')
+
+    service_date = service_date or current_service_date()
+    service_path = os.path.join(cache_path, f'service-{service_date:%Y%m%d}-{service_days}')
+    if not os.path.isdir(service_path):
+        write_service_cache(calendar, cache_path, service_path, service_date, service_days)
+
+    tables = {**read_cache(cache_path, ('stops', 'routes')), **read_cache(service_path, SERVICE_TABLES)}
+    return StaticFeed(subdir, **tables, key=f'{subdir}-{fingerprint}-{service_date:%Y%m%d}',
+                      service=read_metadata(service_path))
+
+
+def load_route_ids(subdir):
+    # The routes that have trips on any day, in routes.txt order, so the selectors can be filled
+    # without loading the whole system. Without a cache only the route_id columns of routes.txt
+    # and trips.txt are read; the full build waits until the system is first selected.
+    _, cache_path = cache_location(subdir)
+    if not os.path.isdir(cache_path):
+        folder_path = os.path.join(GTFS_DIR, subdir)
+        routes = read_table(folder_path, 'routes.txt', ['route_id'], {'route_id': str})
+        trips = read_table(folder_path, 'trips.txt', ['route_id'], {'route_id': 'category'})
+        route_ids = routes['route_id'].values
+        return route_ids[pd.Index(trips['route_id'].cat.categories).get_indexer(route_ids) >= 0]
+    tables = read_cache(cache_path, ('routes', 'trips'))
+    route_codes = np.unique(tables['trips']['route_code'].values)
+    return tables['routes']['route_id'].values[route_codes[route_codes >= 0]]
+
+
+class SystemRegistry:
+    # Static systems are loaded on first use and dropped least recently used first once their
+    # combined size passes max_bytes. A system larger than the whole budget is loaded for
+    # each use and never kept.
+    def __init__(self, names, max_bytes, loader=load_system):
+        self.names = list(names)
+        self._loader = loader
+        self._systems = SizedLRUCache(max_bytes, sizeof=lambda system: system.memory_bytes())
+        self._locks = {name: threading.Lock() for name in self.names}
+        self._route_ids = {}
+        self._states = {}
+        self._load_seconds = {}
+        self._loaded_at = {}
+        # name -> StaticFeed.service of the last load, to report what the calendar cut saved.
+        self._services = {}
+
+    def __getitem__(self, name):
+        # Per-system lock so concurrent callbacks wait for one load instead of starting their own.
+        # A system cut to yesterday's service is replaced by today's on first use after midnight.
+        with self._locks[name]:
+            system = self._systems.get_or_build(name, lambda: self._load(name))
+            if system.service_date is not None and system.service_date != current_service_date():
+                system = self._systems.put(name, self._load(name))
+            return system
+
+    def _load(self, name):
+        self._states[name] = 'loading'
+        started = time.monotonic()
+        try:
+            system = self._loader(name)
+        except Exception as error:
+            self._states[name] = f'failed: {error!r}'
+            raise
+        self._states[name] = 'loaded'
+        if system.service is not None:
+            self._services[name] = system.service
+        self._loaded_at[name] = time.monotonic()
+        self._load_seconds[name] = round(self._loaded_at[name] - started, 3)
+        return system
+
+    def route_ids(self, name):
+        if name not in self._route_ids:
+            self._route_ids[name] = load_route_ids(name)
+        return self._route_ids[name]
+
+    def preload(self, names):
+        def load_all():
+            for name in names:
+                self[name]
+
+        thread = threading.Thread(target=load_all, name='static-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return dict(self._systems.stats(), loaded=self._systems.keys())
+
+    def status(self):
+        loaded = set(self._systems.keys())
+        status = {}
+        for name in self.names:
+            state = self._states.get(name, 'not loaded')
+            if state == 'loaded' and name not in loaded:
+                state = 'evicted'
+            status[name] = {'state': state, 'load_seconds': self._load_seconds.get(name)}
+            service = self._services.get(name)
+            if service is not None:
+                status[name].update(service_date=service['service_date'], trips=service['trips'],
+                                    all_trips=service['all_trips'], bytes_saved=service['all_bytes'] - service['bytes'])
+        return status
+
+    def loaded_at(self, names):
+        # Monotonic time the last of names finished loading, None while any is still missing.
+        if not all(name in self._loaded_at for name in names):
+            return None
+        return max((self._loaded_at[name] for name in names), default=0.0)
@@ -0,0 +1,136 @@
+import numpy as np
+
+# Detail levels by map zoom. Tolerance is the Douglas-Peucker distance in degrees, precision
+# the decimals kept on coordinates (3 ~ 110 m, 5 ~ 1 m), stops whether stop markers are sent.
+# At zoom 10 a pixel spans about 0.0014 degrees, so the low level's lines stay within two
+# pixels of the shape and its rounding within half a pixel.
+DETAIL_LEVELS = {
+    'low': dict(max_zoom=10, tolerance=0.0028, precision=3, stops=False),
+    'medium': dict(max_zoom=12, tolerance=0.0001, precision=5, stops=True),
+    'high': dict(max_zoom=None, tolerance=0.0, precision=5, stops=True),
+}
+
+# Upper bounds for the serialized figure with every route of every system and all Citibike
+# regions selected, as benchmarks/run.py renders it; the run fails when one is exceeded.
+PAYLOAD_TARGET_BYTES = {
+    'low': 1_000_000,
+    'medium': 4_000_000,
+    'high': None,
+}
+
+DEFAULT_ZOOM = 10
+
+
+def detail_level(zoom):
+    for level, settings in DETAIL_LEVELS.items():
+        if settings['max_zoom'] is None or zoom < settings['max_zoom']:
+            return level
+
+
+def simplify(lat, lon, tolerance):
+    # Douglas-Peucker on the polyline; returns the indices of the points to keep.
+    count = len(lat)
+    if tolerance <= 0 or count < 3:
+        return np.arange(count)
+
+    points = np.column_stack([lon, lat])
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def polyline(lat, lon, level):
+    settings = DETAIL_LEVELS[level]
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    kept = simplify(lat, lon, settings['tolerance'])
+    return quantize(lat[kept], level), quantize(lon[kept], level)
+
+
+def quantize(values, level):
+    return np.round(np.asarray(values, dtype='float64'), DETAIL_LEVELS[level]['precision'])
+
+
+# Features are kept within the viewport grown by this fraction of its size on every side, and
+# the bounds are snapped outward to CULL_SNAP degrees so small pans reuse the rendered figure.
+CULL_MARGIN = 0.25
+CULL_SNAP = 0.05
+
+
+def view_bounds(corners):
+    # corners are the [lon, lat] pairs plotly reports in relayoutData['mapbox._derived'].
+    lons = [corner[0] for corner in corners]
+    lats = [corner[1] for corner in corners]
+    west, east, south, north = min(lons), max(lons), min(lats), max(lats)
+    margin_lon = (east - west) * CULL_MARGIN
+    margin_lat = (north - south) * CULL_MARGIN
+    return [
+        round(float(np.floor((west - margin_lon) / CULL_SNAP)) * CULL_SNAP, 4),
+        round(float(np.floor((south - margin_lat) / CULL_SNAP)) * CULL_SNAP, 4),
+        round(float(np.ceil((east + margin_lon) / CULL_SNAP)) * CULL_SNAP, 4),
+        round(float(np.ceil((north + margin_lat) / CULL_SNAP)) * CULL_SNAP, 4),
+    ]
+
+
+def within(lat, lon, bounds):
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    if bounds is None:
+        return np.ones(len(lat), dtype=bool)
+    west, south, east, north = bounds
+    return (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+
+
+class GridIndex:
+    # Points bucketed into square cells; a query only looks at points in the cells the bounds
+    # overlap instead of testing every point.
+    def __init__(self, lat, lon, cell_size=0.01):
+        self.lat = np.asarray(lat, dtype='float64')
+        self.lon = np.asarray(lon, dtype='float64')
+        self.cell_size = cell_size
+        columns = np.floor(self.lon / cell_size).astype('int64')
+        rows = np.floor(self.lat / cell_size).astype('int64')
+        self._min_column = columns.min() if len(columns) else 0
+        self._width = (columns.max() - self._min_column + 1) if len(columns) else 1
+        self._row_range = (rows.min(), rows.max()) if len(rows) else (0, -1)
+        cells = (rows * self._width) + (columns - self._min_column)
+        self._order = np.argsort(cells, kind='stable')
+        self._cells = cells[self._order]
+
+    def query(self, bounds):
+        # Positions of the points inside bounds, in their original order.
+        if bounds is None:
+            return np.arange(len(self.lat))
+        west, south, east, north = bounds
+        first_column = max(int(np.floor(west / self.cell_size)), self._min_column)
+        last_column = min(int(np.floor(east / self.cell_size)), self._min_column + self._width - 1)
+        if first_column > last_column:
+            return np.arange(0)
+        candidates = []
+        first_row = max(int(np.floor(south / self.cell_size)), self._row_range[0])
+        last_row = min(int(np.floor(north / self.cell_size)), self._row_range[1])
+        for row in range(first_row, last_row + 1):
+            start = row * self._width + (first_column - self._min_column)
+            end = row * self._width + (last_column - self._min_column)
+            lo, hi = np.searchsorted(self._cells, [start, end + 1])
+            candidates.append(self._order[lo:hi])
+        positions = np.sort(np.concatenate(candidates)) if candidates else np.arange(0)
+        return positions[within(self.lat[positions], self.lon[positions], bounds)]
@@ -0,0 +1,98 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; from a cache hit up to a slow upstream fetch.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+# name -> [kind, help, buckets, {label tuple: value}]; a histogram value is [bucket counts, sum, count].
+_families = {}
+# Functions called at scrape time that yield (name, labels, value) for gauges read from live state.
+_collectors = []
+
+
+def describe(name, kind, help, buckets=DEFAULT_BUCKETS):
+    with _lock:
+        _families.setdefault(name, [kind, help, tuple(buckets), {}])
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _label_key(labels)
+    with _lock:
+        samples = _families[name][3]
+        samples[key] = samples.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _families[name][3][_label_key(labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _label_key(labels)
+    with _lock:
+        _, _, buckets, samples = _families[name]
+        histogram = samples.get(key)
+        if histogram is None:
+            histogram = samples[key] = [[0] * len(buckets), 0.0, 0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in pairs) + '}'
+
+
+def render():
+    # Prometheus text exposition format, version 0.0.4.
+    collected = {}
+    for collect in _collectors:
+        for name, labels, value in collect():
+            collected.setdefault(name, {})[_label_key(labels)] = value
+
+    lines = []
+    with _lock:
+        for name, (kind, help, buckets, samples) in sorted(_families.items()):
+            if name in collected:
+                samples = {**samples, **collected[name]}
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(samples.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(key)} {value}')
+                    continue
+                counts, total, count = value
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {bucket_count}')
+                lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{_format_labels(key)} {total}')
+                lines.append(f'{name}_count{_format_labels(key)} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,235 @@
+import fcntl
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import requests
+
+from fetch import feed_label
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple('Snapshot', ['value', 'source', 'fetched_at', 'version'])
+FeedSource = namedtuple('FeedSource', ['fetch', 'interval', 'ttl', 'derive'])
+
+
+class SnapshotStore:
+    # Raw feed values shared by every process on the host through one SQLite file in WAL mode,
+    # so readers never block the writer. Only the process holding the lock file polls upstream.
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock_file = None
+        self._election_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS snapshots '
+                           '(name TEXT PRIMARY KEY, version INTEGER, fetched_at REAL, payload BLOB)')
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads, so each thread opens its own.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def elect(self):
+        # True in the one process that holds the poller lock. The lock is released by the OS
+        # when that process exits, and whichever process asks next takes over.
+        with self._election_lock:
+            if self._lock_file is None:
+                lock_file = open(f'{self.path}.lock', 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return False
+                logger.info('process %s is polling realtime feeds for %s', os.getpid(), self.path)
+                self._lock_file = lock_file
+            return True
+
+    def write(self, name, value, fetched_at):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT version FROM snapshots WHERE name = ?', (name,)).fetchone()
+            version = row[0] + 1 if row is not None else 1
+            connection.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+                               (name, version, fetched_at, payload))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return version
+
+    def touch(self, name, fetched_at):
+        self._connection().execute('UPDATE snapshots SET fetched_at = ? WHERE name = ?', (fetched_at, name))
+
+    def read(self, name, known_version=0):
+        # (version, fetched_at, value), with value None when the stored version is not newer
+        # than known_version so unchanged snapshots are not unpickled again.
+        connection = self._connection()
+        row = connection.execute('SELECT version, fetched_at FROM snapshots WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        if row[0] <= known_version:
+            return row[0], row[1], None
+        row = connection.execute('SELECT version, fetched_at, payload FROM snapshots WHERE name = ?',
+                                 (name,)).fetchone()
+        return row[0], row[1], pickle.loads(row[2])
+
+
+def error_summary(error):
+    # What status() reports for a failed refresh. Never the exception text: a failed request's
+    # message carries its URL, and the OBA feeds put the API key in the query string.
+    url = getattr(getattr(error, 'request', None), 'url', None)
+    if url:
+        return f'{type(error).__name__} fetching {feed_label(url)}'
+    return type(error).__name__
+
+
+class SnapshotCache:
+    def __init__(self, store=None):
+        # With a store, only the elected process fetches; the others load what it wrote.
+        self._store = store
+        self._sources = {}
+        self._snapshots = {}
+        self._locks = {}
+        # name -> last refresh error, and monotonic time of the first snapshot or error.
+        self._errors = {}
+        self._settled_at = {}
+        self._listeners = {}
+        self._threads = []
+        self._stop = threading.Event()
+
+    def register(self, name, fetch, interval, ttl=None, derive=None):
+        # derive builds indexes from what fetch returned; it is skipped when fetch hands back
+        # the very same object as last time, which is how exporters report an unchanged feed.
+        self._sources[name] = FeedSource(fetch, interval, ttl if ttl is not None else interval * 5, derive)
+        self._locks[name] = threading.Lock()
+
+    def subscribe(self, name, listener):
+        # listener(raw, fetched_at, version) runs for every new value fetched from upstream. With
+        # a shared store it runs only in the polling process, so each value is seen once per host.
+        self._listeners.setdefault(name, []).append(listener)
+
+    def get(self, name, default=None):
+        return self.get_versioned(name, default)[0]
+
+    def get_versioned(self, name, default=None):
+        # (value, version) of one snapshot, so callers can tell later whether it has changed.
+        snapshot = self._snapshots.get(name)
+        if snapshot is None or time.time() - snapshot.fetched_at > self._sources[name].ttl:
+            return default, None
+        return snapshot.value, snapshot.version
+
+    def refresh(self, name):
+        # Single-flight: a caller that queued behind an in-progress refresh reuses its result
+        # instead of issuing a second upstream request. Times are wall-clock because they are
+        # compared across processes when a store is shared.
+        requested_at = time.time()
+        with self._locks[name]:
+            snapshot = self._snapshots.get(name)
+            if snapshot is not None and snapshot.fetched_at >= requested_at:
+                return snapshot
+
+            if self._store is not None and not self._store.elect():
+                snapshot = self._load(name, snapshot)
+            else:
+                snapshot = self._fetch(name, snapshot)
+            if snapshot is not None:
+                self._snapshots[name] = snapshot
+                self._errors.pop(name, None)
+                self._settled_at.setdefault(name, time.monotonic())
+            return snapshot
+
+    def _fetch(self, name, snapshot):
+        source = self._sources[name]
+        raw = source.fetch()
+        fetched_at = time.time()
+        if snapshot is not None and raw is snapshot.source:
+            if self._store is not None:
+                self._store.touch(name, fetched_at)
+            return snapshot._replace(fetched_at=fetched_at)
+
+        value = source.derive(raw) if source.derive is not None else raw
+        if self._store is not None:
+            version = self._store.write(name, raw, fetched_at)
+        else:
+            version = snapshot.version + 1 if snapshot is not None else 1
+        for listener in self._listeners.get(name, []):
+            try:
+                listener(raw, fetched_at, version)
+            except Exception:
+                logger.exception('listener for realtime feed %s failed', name)
+        return Snapshot(value, raw, fetched_at, version)
+
+    def _load(self, name, snapshot):
+        stored = self._store.read(name, snapshot.version if snapshot is not None else 0)
+        if stored is None:
+            return snapshot
+        version, fetched_at, raw = stored
+        if raw is None:
+            return snapshot._replace(fetched_at=fetched_at)
+        source = self._sources[name]
+        value = source.derive(raw) if source.derive is not None else raw
+        return Snapshot(value, raw, fetched_at, version)
+
+    def status(self):
+        # A feed is settled once its first refresh produced a snapshot or failed, so a dead
+        # upstream is reported instead of holding readiness back forever.
+        now = time.time()
+        status = {}
+        for name, source in self._sources.items():
+            snapshot = self._snapshots.get(name)
+            status[name] = {
+                'settled': name in self._settled_at,
+                'version': snapshot.version if snapshot is not None else None,
+                'age': round(now - snapshot.fetched_at, 1) if snapshot is not None else None,
+                'stale': snapshot is None or now - snapshot.fetched_at > source.ttl,
+                'error': self._errors.get(name),
+            }
+        return status
+
+    def settled_at(self):
+        return max(self._settled_at.values()) if len(self._settled_at) == len(self._sources) else None
+
+    def _poll(self, name):
+        interval = self._sources[name].interval
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh(name)
+            except requests.RequestException as error:
+                # No traceback: it would print the request URL, API key included.
+                self._errors[name] = error_summary(error)
+                logger.warning('refreshing realtime feed %s failed: %s', name, self._errors[name])
+                self._settled_at.setdefault(name, time.monotonic())
+            except Exception as error:
+                logger.exception('refreshing realtime feed %s failed', name)
+                self._errors[name] = error_summary(error)
+                self._settled_at.setdefault(name, time.monotonic())
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for name in self._sources:
+            thread = threading.Thread(target=self._poll, args=(name,), name=f'poll-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import numpy as np
+import requests
+
+import clock
+import fetch
+
+# Pollers never wait less than this between requests, even at 'max' speed.
+MIN_INTERVAL = 0.1
+
+
+def replay_speed(text):
+    # '1', '10', ... times real time, or 'max' to serve every recording as fast as it is polled.
+    return None if text.strip().lower() == 'max' else float(text)
+
+
+class FeedReplay:
+    # Answers upstream requests from a directory written by fetch.set_recorder():
+    #   <directory>/<quoted host and path>/<epoch ms>.bin
+    # At a numeric speed, a clock starts at the first recording on the first request and runs
+    # speed times faster than real time; every feed returns its latest recording at or before
+    # that clock. At 'max' speed each poll gets the feed's next recording and the clock follows
+    # the newest one served. install() points gtfs_rt and gbfs at that clock, so "passed" and
+    # "today" mean what they meant when the feeds were recorded. Past the end of the recording
+    # the clock stops and every feed keeps answering "not modified".
+    def __init__(self, directory, speed=1.0):
+        self.directory = directory
+        self.speed = speed
+        self._recordings = {}
+        for name in sorted(os.listdir(directory)):
+            folder = os.path.join(directory, name)
+            if not os.path.isdir(folder):
+                continue
+            times = np.array(sorted(int(entry[:-4]) for entry in os.listdir(folder) if entry.endswith('.bin')),
+                             dtype='int64')
+            if len(times):
+                self._recordings[folder] = times
+        if not self._recordings:
+            raise ValueError(f'no recorded feeds in {directory}')
+        self.start_ms = int(min(times[0] for times in self._recordings.values()))
+        self.end_ms = int(max(times[-1] for times in self._recordings.values()))
+        self._lock = threading.Lock()
+        self._started = None
+        self._clock_ms = self.start_ms
+        # feed folder -> position of the recording it last returned
+        self._served = {}
+
+    def install(self):
+        fetch.set_source(self)
+        clock.set_clock(self.now)
+
+    def uninstall(self):
+        fetch.set_source(None)
+        clock.set_clock(None)
+
+    def poll_timing(self, interval, ttl):
+        # Poll interval and snapshot ttl that keep the pollers in step with the replay clock.
+        # At 'max' speed the ttl stays in real seconds, since the replay clock jumps.
+        if self.speed is None:
+            return MIN_INTERVAL, ttl
+        return max(interval / self.speed, MIN_INTERVAL), ttl / self.speed
+
+    def now(self):
+        with self._lock:
+            return self._now_ms() / 1000
+
+    def _now_ms(self):
+        if self.speed is None:
+            return self._clock_ms
+        if self._started is None:
+            self._started = time.monotonic()
+        return min(self.start_ms + (time.monotonic() - self._started) * self.speed * 1000, self.end_ms)
+
+    def finished(self):
+        with self._lock:
+            if self.speed is not None:
+                return self._now_ms() >= self.end_ms
+            return all(self._served.get(folder) == len(times) - 1 for folder, times in self._recordings.items())
+
+    def fetch(self, url, conditional=False):
+        folder = fetch.recording_folder(self.directory, url)
+        times = self._recordings.get(folder)
+        if times is None:
+            raise requests.ConnectionError(f'no recording of {fetch.feed_label(url)} in {self.directory}')
+
+        with self._lock:
+            served = self._served.get(folder)
+            if self.speed is None:
+                # Polls walk through the recordings; a plain request repeats the current one.
+                if served is None:
+                    position = 0
+                elif conditional:
+                    position = min(served + 1, len(times) - 1)
+                else:
+                    position = served
+                self._clock_ms = max(self._clock_ms, int(times[position]))
+            else:
+                # A feed whose first recording is still ahead of the clock starts with it.
+                position = max(int(np.searchsorted(times, self._now_ms(), side='right')) - 1, 0)
+            if conditional and position == served:
+                return None
+            self._served[folder] = position
+
+        with open(os.path.join(folder, f'{times[position]}.bin'), 'rb') as recording:
+            return recording.read()
@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from archive import SnapshotArchive
+
+HOUR = datetime(2024, 5, 1, 13, tzinfo=timezone.utc).timestamp()
+
+
+def updates(route_ids):
+    return pd.DataFrame({
+        'route_id': pd.Categorical(route_ids),
+        'stop_id': [f'S{position}' for position in range(len(route_ids))],
+        'arrival': list(range(len(route_ids))),
+    })
+
+
+def test_snapshots_are_written_by_hour_and_read_back(tmp_path):
+    archive = SnapshotArchive(str(tmp_path))
+    archive.start()
+    archive.submit('trip_updates', updates(['R1', 'R2']), HOUR + 60, feed='subway')
+    archive.submit('trip_updates', updates(['R1']), HOUR + 120, feed='bus')
+    archive.submit('trip_updates', updates(['R1', 'R3']), HOUR + 3600 + 60, feed='subway')
+    archive.stop()
+
+    assert sorted(path.name for path in (tmp_path / 'trip_updates').iterdir()) == [
+        'hour=2024-05-01T13', 'hour=2024-05-01T14']
+
+    first_hour = archive.read('trip_updates', HOUR, HOUR + 3599)
+    assert len(first_hour) == 3
+    assert sorted(first_hour['feed']) == ['bus', 'subway', 'subway']
+    assert first_hour['fetched_at'].min() == pd.Timestamp(HOUR + 60, unit='s', tz='UTC')
+
+    r1 = archive.read('trip_updates', HOUR, HOUR + 7200, columns=['route_id', 'feed'], route_id='R1')
+    assert r1['route_id'].tolist() == ['R1', 'R1', 'R1']
+    assert r1.columns.tolist() == ['route_id', 'feed']
+
+    assert len(archive.read('trip_updates', HOUR + 100, HOUR + 3600 + 100)) == 3
+    assert archive.read('trip_updates', HOUR - 7200, HOUR - 3600).empty
+
+
+def test_reading_a_kind_never_written(tmp_path):
+    assert SnapshotArchive(str(tmp_path)).read('citibike_status', HOUR, HOUR + 3600).empty
+
+
+def test_empty_snapshots_are_not_queued(tmp_path):
+    assert not SnapshotArchive(str(tmp_path)).submit('trip_updates', updates([]), HOUR)
+
+
+def test_hours_outside_the_range_are_not_opened(tmp_path):
+    archive = SnapshotArchive(str(tmp_path))
+    archive.start()
+    archive.submit('trip_updates', updates(['R1']), HOUR + 60)
+    archive.stop()
+    later = tmp_path / 'trip_updates' / 'hour=2024-05-01T15'
+    later.mkdir()
+    (later / 'part-unreadable.parquet').write_bytes(b'not parquet')
+
+    assert len(archive.read('trip_updates', HOUR, HOUR + 3599)) == 1
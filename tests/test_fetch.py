@@ -0,0 +1,89 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import fetch
+
+ETAG = '"v1"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # /slow answers after half a second, /stall after longer than the tests' timeout,
+    # /error with a 500 and /etag with 304 once the client sends its ETag back.
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        elif self.path.startswith('/stall'):
+            time.sleep(1.5)
+        elif self.path.startswith('/error'):
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        elif self.path.startswith('/etag') and self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path.startswith('/etag'):
+            self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_all_runs_requests_concurrently(server):
+    urls = [f'{server}/slow/{number}' for number in range(4)]
+    started = time.monotonic()
+    results = fetch.fetch_all(urls)
+    elapsed = time.monotonic() - started
+
+    assert [result.url for result in results] == urls
+    assert [result.content for result in results] == [f'/slow/{number}'.encode() for number in range(4)]
+    assert all(result.error is None for result in results)
+    assert elapsed < 1.5
+
+
+def test_fetch_all_reports_a_timeout_as_an_error(server):
+    [result] = fetch.fetch_all([f'{server}/stall'], timeout=(1, 0.2))
+
+    assert result.content is None
+    assert isinstance(result.error, requests.Timeout)
+
+
+def test_fetch_all_keeps_the_feeds_that_arrived(server):
+    results = fetch.fetch_all([f'{server}/ok/1', f'{server}/error', f'{server}/ok/2'])
+
+    assert [result.content for result in results] == [b'/ok/1', None, b'/ok/2']
+    assert results[0].error is None and results[2].error is None
+    assert isinstance(results[1].error, requests.HTTPError)
+
+
+def test_fetch_all_not_modified(server):
+    url = f'{server}/etag'
+    [first] = fetch.fetch_all([url], conditional=True)
+    [second] = fetch.fetch_all([url], conditional=True)
+    [plain] = fetch.fetch_all([url], conditional=[False])
+
+    assert first.content == b'/etag'
+    assert second.content is None and second.error is None
+    assert plain.content == b'/etag'
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import clock
+import fetch
+from gbfs import StationFeed
+
+INFORMATION_URL = 'https://gbfs.test/station_information.json'
+STATUS_URL = 'https://gbfs.test/station_status.json'
+REGIONS_URL = 'https://gbfs.test/system_regions.json'
+
+
+class DocumentSource:
+    # Serves GBFS documents and answers a conditional request with "not modified" unless the
+    # document was replaced since it was last served.
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = []
+        self._served = set()
+
+    def fetch(self, url, conditional=False):
+        self.requests.append((url, conditional))
+        if conditional and url in self._served:
+            return None
+        self._served.add(url)
+        return json.dumps(self.documents[url]).encode()
+
+    def replace(self, url, document):
+        self.documents[url] = document
+        self._served.discard(url)
+
+
+def status_document(last_updated, ttl, bikes):
+    return {'last_updated': last_updated, 'ttl': ttl, 'data': {'stations': [
+        {'station_id': station_id, 'num_bikes_available': count} for station_id, count in bikes.items()]}}
+
+
+@pytest.fixture
+def source():
+    source = DocumentSource({
+        INFORMATION_URL: {'data': {'stations': [
+            {'station_id': station_id, 'name': f'Station {station_id}', 'lat': 40.7, 'lon': -74.0,
+             'capacity': 10, 'region_id': '1'} for station_id in ('a', 'b', 'c')]}},
+        REGIONS_URL: {'data': {'regions': [{'region_id': '1', 'name': 'NYC District'}]}},
+        STATUS_URL: status_document(1000, 10, {'a': 3, 'b': 5}),
+    })
+    now = [1000.0]
+    fetch.set_source(source)
+    clock.set_clock(lambda: now[0])
+    source.now = now
+    yield source
+    fetch.set_source(None)
+    clock.set_clock(None)
+
+
+def test_status_is_written_into_the_station_frame(source):
+    stations = StationFeed(INFORMATION_URL, STATUS_URL, REGIONS_URL).refresh().stations
+
+    assert stations['region_name'].tolist() == ['NYC District'] * 3
+    assert stations['num_bikes_available'].tolist() == [3, 5, 0]
+    # c is missing from the status document.
+    assert stations['reporting'].tolist() == [True, True, False]
+
+
+def test_status_is_fetched_only_after_its_ttl(source):
+    feed = StationFeed(INFORMATION_URL, STATUS_URL, REGIONS_URL)
+    first = feed.refresh()
+    source.requests.clear()
+
+    source.now[0] = 1005.0
+    assert feed.refresh() is first
+    assert source.requests == []
+
+    source.now[0] = 1011.0
+    assert feed.refresh() is first
+    assert source.requests == [(STATUS_URL, True)]
+
+    source.replace(STATUS_URL, status_document(1011, 10, {'a': 1}))
+    second = feed.refresh()
+    assert second is not first
+    assert second.stations['num_bikes_available'].tolist() == [1, 0, 0]
+    assert second.index is first.index
+    source.requests.clear()
+    source.now[0] = 1015.0
+    assert feed.refresh() is second
+    assert source.requests == []
+
+
+def test_force_fetches_status_before_its_ttl(source):
+    feed = StationFeed(INFORMATION_URL, STATUS_URL, REGIONS_URL)
+    feed.refresh()
+    source.requests.clear()
+    source.replace(STATUS_URL, status_document(1000, 10, {'a': 9}))
+
+    assert feed.refresh(force=True).stations['num_bikes_available'].tolist() == [9, 0, 0]
+    assert source.requests == [(STATUS_URL, True)]
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import clock
+from gtfs_rt import format_epoch, index_next_stop_times, join_stop_times
+
+NOW = datetime(2024, 5, 1, 12, 0).timestamp()
+TODAY = int(datetime(2024, 5, 1, 13, 0).timestamp())
+YESTERDAY = int(datetime(2024, 4, 30, 23, 0).timestamp())
+
+
+@pytest.fixture(autouse=True)
+def fixed_clock():
+    clock.set_clock(lambda: NOW)
+    yield
+    clock.set_clock(None)
+
+
+def stop_times(rows):
+    return pd.DataFrame(rows, columns=['stop_id', 'arrival', 'departure']).set_index('stop_id')
+
+
+def test_join_stop_times_marks_stale_times():
+    stops = pd.DataFrame({'stop_id': ['fresh', 'stale arrival', 'no departure', 'stale departure', 'missing']})
+    joined = join_stop_times(stops, stop_times([
+        ('fresh', TODAY, TODAY + 60),
+        ('stale arrival', YESTERDAY, TODAY),
+        ('no departure', TODAY, 0),
+        ('stale departure', TODAY, YESTERDAY),
+    ]))
+
+    assert joined['stop_id'].tolist() == stops['stop_id'].tolist()
+    assert joined['arrival_time'].tolist() == [format_epoch(TODAY), 'N/A', format_epoch(TODAY), format_epoch(TODAY), 'N/A']
+    assert joined['departure_time'].tolist() == [format_epoch(TODAY + 60), format_epoch(TODAY), 'N/A', 'N/A', 'N/A']
+
+
+def test_join_stop_times_without_realtime():
+    joined = join_stop_times(pd.DataFrame({'stop_id': ['a', 'b']}), None)
+
+    assert joined['arrival_time'].tolist() == ['N/A', 'N/A']
+    assert joined['departure_time'].tolist() == ['N/A', 'N/A']
+
+
+def test_index_next_stop_times_prefers_the_soonest_upcoming_update():
+    updates = pd.DataFrame({
+        'route_id': ['R1', 'R1', 'R1', 'R1', 'R1', 'R1', 'R2'],
+        'stop_id': ['S1', 'S1', 'S1', 'S2', 'S2', 'S3', 'S1'],
+        'arrival': [900, 1100, 1050, 800, 900, 990, 1200],
+        'departure': [900, 1100, 1050, 800, 900, 1010, 1200],
+    })
+    index = index_next_stop_times(updates, now=1000)
+
+    assert sorted(index) == ['R1', 'R2']
+    assert index['R1'].loc['S1', 'arrival'] == 1050
+    # Every update for S2 has passed, so the most recent one is kept.
+    assert index['R1'].loc['S2', 'arrival'] == 900
+    # Departing after now counts as upcoming even though the arrival has passed.
+    assert index['R1'].loc['S3', 'departure'] == 1010
+    assert index['R2'].loc['S1', 'arrival'] == 1200
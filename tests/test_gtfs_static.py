@@ -0,0 +1,42 @@
+from datetime import date
+
+import pandas as pd
+
+from gtfs_static import WEEKDAYS, active_services
+
+
+def calendar(rows):
+    return pd.DataFrame([{'service_id': service_id, **dict(zip(WEEKDAYS, days)), 'start_date': start, 'end_date': end}
+                         for service_id, days, start, end in rows])
+
+
+CALENDAR = calendar([
+    ('WEEKDAY', [1, 1, 1, 1, 1, 0, 0], 20240101, 20241231),
+    ('SATURDAY', [0, 0, 0, 0, 0, 1, 0], 20240101, 20241231),
+    ('EXPIRED', [1, 1, 1, 1, 1, 1, 1], 20230101, 20231231),
+])
+CALENDAR_DATES = pd.DataFrame({
+    'service_id': ['WEEKDAY', 'HOLIDAY'],
+    'date': [20240527, 20240527],
+    'exception_type': [2, 1],
+})
+
+
+def test_active_services_follow_the_weekly_pattern():
+    assert active_services(CALENDAR, CALENDAR_DATES, date(2024, 5, 1)) == {'WEEKDAY'}
+    assert active_services(CALENDAR, CALENDAR_DATES, date(2024, 5, 4)) == {'SATURDAY'}
+    assert active_services(CALENDAR, CALENDAR_DATES, date(2024, 5, 5)) == set()
+
+
+def test_active_services_respect_the_date_range():
+    assert active_services(CALENDAR, CALENDAR_DATES, date(2023, 6, 1)) == {'EXPIRED'}
+    assert active_services(CALENDAR, CALENDAR_DATES, date(2025, 1, 1)) == set()
+
+
+def test_active_services_apply_calendar_dates():
+    assert active_services(CALENDAR, CALENDAR_DATES, date(2024, 5, 27)) == {'HOLIDAY'}
+
+
+def test_active_services_without_calendar():
+    assert active_services(calendar([]).reindex(columns=CALENDAR.columns), CALENDAR_DATES,
+                           date(2024, 5, 27)) == {'HOLIDAY'}
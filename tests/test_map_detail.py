@@ -0,0 +1,51 @@
+import numpy as np
+
+from map_detail import GridIndex, simplify
+
+
+def test_grid_index_query():
+    lat = [40.70, 40.75, 40.80, 40.71]
+    lon = [-74.00, -73.95, -73.90, -73.99]
+    index = GridIndex(lat, lon)
+
+    assert index.query(None).tolist() == [0, 1, 2, 3]
+    assert index.query([-74.005, 40.695, -73.985, 40.715]).tolist() == [0, 3]
+    # Bounds reaching past the indexed cells are clamped to them.
+    assert index.query([-80.0, 30.0, -70.0, 50.0]).tolist() == [0, 1, 2, 3]
+    assert index.query([-73.0, 40.0, -72.0, 41.0]).tolist() == []
+
+
+def test_grid_index_includes_points_on_the_bounds():
+    index = GridIndex([40.70, 40.80], [-74.00, -73.90])
+
+    assert index.query([-74.00, 40.70, -73.90, 40.80]).tolist() == [0, 1]
+
+
+def test_grid_index_without_points():
+    index = GridIndex([], [])
+
+    assert index.query(None).tolist() == []
+    assert index.query([-74.0, 40.0, -73.0, 41.0]).tolist() == []
+
+
+def test_simplify_drops_points_on_a_straight_line():
+    lat = np.linspace(40.0, 41.0, 50)
+    lon = np.linspace(-74.0, -73.0, 50)
+
+    assert simplify(lat, lon, 0.0001).tolist() == [0, 49]
+    assert simplify(lat, lon, 0).tolist() == list(range(50))
+
+
+def test_simplify_keeps_corners_and_endpoints():
+    lat = [0.0, 0.5, 1.0, 0.5, 0.0]
+    lon = [0.0, 0.5, 1.0, 1.5, 2.0]
+
+    assert simplify(lat, lon, 0.1).tolist() == [0, 2, 4]
+
+
+def test_simplify_closed_loop():
+    lat = [0.0, 1.0, 1.0, 0.0, 0.0]
+    lon = [0.0, 0.0, 1.0, 1.0, 0.0]
+
+    assert simplify(lat, lon, 0.1).tolist() == [0, 1, 2, 3, 4]
+    assert simplify([0.0, 1.0], [0.0, 1.0], 0.1).tolist() == [0, 1]
@@ -0,0 +1,40 @@
+import metrics
+
+metrics.describe('test_requests_total', 'counter', 'Requests by outcome.')
+metrics.describe('test_depth', 'gauge', 'Queue depth.')
+metrics.describe('test_seconds', 'histogram', 'Request time.', buckets=(0.1, 1.0))
+metrics.register_collector(lambda: [('test_depth', {'queue': 'live'}, 7)])
+
+
+def family(text, name):
+    return [line for line in text.splitlines() if line.startswith((name, f'# HELP {name} ', f'# TYPE {name} '))]
+
+
+def test_render_counters_and_gauges():
+    metrics.inc('test_requests_total', outcome='ok')
+    metrics.inc('test_requests_total', 2, outcome='ok')
+    metrics.inc('test_requests_total', feed='a"b\\c', outcome='error')
+    metrics.set_gauge('test_depth', 3, queue='set')
+    text = metrics.render()
+
+    assert family(text, 'test_requests_total') == [
+        '# HELP test_requests_total Requests by outcome.',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{feed="a\\"b\\\\c",outcome="error"} 1',
+        'test_requests_total{outcome="ok"} 3',
+    ]
+    assert 'test_depth{queue="live"} 7' in family(text, 'test_depth')
+    assert 'test_depth{queue="set"} 3' in family(text, 'test_depth')
+
+
+def test_render_histograms():
+    for value in (0.05, 0.5, 5.0):
+        metrics.observe('test_seconds', value, stage='all')
+
+    assert family(metrics.render(), 'test_seconds')[2:] == [
+        'test_seconds_bucket{stage="all",le="0.1"} 1',
+        'test_seconds_bucket{stage="all",le="1.0"} 2',
+        'test_seconds_bucket{stage="all",le="+Inf"} 3',
+        'test_seconds_sum{stage="all"} 5.55',
+        'test_seconds_count{stage="all"} 3',
+    ]
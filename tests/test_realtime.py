@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from realtime import SnapshotCache, SnapshotStore
+
+
+def test_refresh_is_single_flight():
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return {'calls': len(calls)}
+
+    cache = SnapshotCache()
+    cache.register('feed', slow_fetch, interval=30)
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.refresh('feed')))
+    first.start()
+    entered.wait(5)
+    second = threading.Thread(target=lambda: results.append(cache.refresh('feed')))
+    second.start()
+    time.sleep(0.05)
+    release.set()
+    first.join()
+    second.join()
+
+    assert len(calls) == 1
+    assert results[0] is results[1]
+
+
+def test_unchanged_fetch_keeps_version_and_skips_derive():
+    raw = {'value': 1}
+    derived = []
+    cache = SnapshotCache()
+    cache.register('feed', lambda: raw, interval=30, derive=lambda value: derived.append(value) or len(derived))
+
+    first = cache.refresh('feed')
+    time.sleep(0.01)
+    second = cache.refresh('feed')
+
+    assert derived == [raw]
+    assert second.version == first.version == 1
+    assert second.fetched_at > first.fetched_at
+    assert cache.get_versioned('feed') == (1, 1)
+
+
+def test_new_values_bump_the_version_and_notify_listeners():
+    values = iter([{'value': 1}, {'value': 2}])
+    heard = []
+    cache = SnapshotCache()
+    cache.register('feed', lambda: next(values), interval=30)
+    cache.subscribe('feed', lambda raw, fetched_at, version: heard.append((raw['value'], version)))
+
+    cache.refresh('feed')
+    cache.refresh('feed')
+
+    assert heard == [(1, 1), (2, 2)]
+    assert cache.get_versioned('feed') == ({'value': 2}, 2)
+
+
+def test_stale_snapshots_are_not_served():
+    cache = SnapshotCache()
+    cache.register('feed', lambda: 'value', interval=0.01, ttl=0.05)
+
+    assert cache.get('feed', 'default') == 'default'
+    cache.refresh('feed')
+    assert cache.get('feed', 'default') == 'value'
+    time.sleep(0.1)
+    assert cache.get_versioned('feed', 'default') == ('default', None)
+    assert cache.status()['feed']['stale']
+
+
+def test_a_failed_refresh_keeps_the_last_snapshot():
+    responses = iter(['value', ConnectionError('upstream down')])
+
+    def fetch():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    cache = SnapshotCache()
+    cache.register('feed', fetch, interval=30)
+    cache.refresh('feed')
+    try:
+        cache.refresh('feed')
+    except ConnectionError:
+        pass
+
+    assert cache.get_versioned('feed') == ('value', 1)
+
+
+def test_store_elects_one_poller(tmp_path):
+    path = str(tmp_path / 'realtime.sqlite')
+    polling = SnapshotStore(path)
+    other = SnapshotStore(path)
+
+    assert polling.elect()
+    assert polling.elect()
+    assert not other.elect()
+
+
+def test_store_versions(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'realtime.sqlite'))
+
+    assert store.read('feed') is None
+    assert store.write('feed', {'value': 1}, 100.0) == 1
+    assert store.write('feed', {'value': 2}, 200.0) == 2
+    assert store.read('feed') == (2, 200.0, {'value': 2})
+    # A reader that already has version 2 is not sent the value again.
+    assert store.read('feed', known_version=2) == (2, 200.0, None)
+    store.touch('feed', 300.0)
+    assert store.read('feed', known_version=2) == (2, 300.0, None)
+
+
+def test_processes_that_lose_the_election_load_from_the_store(tmp_path):
+    path = str(tmp_path / 'realtime.sqlite')
+    values = iter([{'value': 1}, {'value': 2}])
+    polling = SnapshotCache(store=SnapshotStore(path))
+    polling.register('feed', lambda: next(values), interval=30)
+    reading = SnapshotCache(store=SnapshotStore(path))
+    reading.register('feed', lambda: pytest.fail('only the elected process fetches'), interval=30,
+                     derive=lambda raw: raw['value'])
+
+    polling.refresh('feed')
+    assert reading.refresh('feed').value == 1
+    polling.refresh('feed')
+    assert reading.get_versioned('feed') == (1, 1)
+    reading.refresh('feed')
+    assert reading.get_versioned('feed') == (2, 2)
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+import requests
+
+import clock
+import fetch
+from replay import MIN_INTERVAL, FeedReplay, replay_speed
+
+TRIPS_URL = 'https://feeds.test/trips?key=secret'
+STATUS_URL = 'https://feeds.test/status.json'
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    for url, times in ((TRIPS_URL, [1000, 2000, 3000]), (STATUS_URL, [1500])):
+        folder = fetch.recording_folder(str(tmp_path), url)
+        os.makedirs(folder)
+        for epoch_ms in times:
+            with open(os.path.join(folder, f'{epoch_ms}.bin'), 'wb') as recording:
+                recording.write(f'{url} {epoch_ms}'.encode())
+    return str(tmp_path)
+
+
+def test_replay_speed():
+    assert replay_speed('max') is None
+    assert replay_speed(' MAX ') is None
+    assert replay_speed('10') == 10.0
+
+
+def test_max_speed_walks_through_recordings(recordings):
+    replay = FeedReplay(recordings, speed=None)
+
+    assert replay.fetch(TRIPS_URL) == f'{TRIPS_URL} 1000'.encode()
+    assert replay.now() == 1.0
+    # A plain request repeats the current recording; a poll moves on to the next one.
+    assert replay.fetch(TRIPS_URL) == f'{TRIPS_URL} 1000'.encode()
+    assert replay.fetch(TRIPS_URL, conditional=True) == f'{TRIPS_URL} 2000'.encode()
+    assert replay.fetch(TRIPS_URL, conditional=True) == f'{TRIPS_URL} 3000'.encode()
+    assert replay.now() == 3.0
+    assert not replay.finished()
+    # Past the end every poll is "not modified".
+    assert replay.fetch(TRIPS_URL, conditional=True) is None
+    assert replay.fetch(STATUS_URL, conditional=True) == f'{STATUS_URL} 1500'.encode()
+    assert replay.finished()
+    assert replay.now() == 3.0
+    assert replay.poll_timing(30, 150) == (MIN_INTERVAL, 150)
+
+
+def test_numeric_speed_follows_the_replay_clock(recordings):
+    replay = FeedReplay(recordings, speed=10.0)
+
+    assert replay.poll_timing(30, 150) == (3.0, 15.0)
+    assert replay.fetch(TRIPS_URL, conditional=True) == f'{TRIPS_URL} 1000'.encode()
+    assert replay.fetch(TRIPS_URL, conditional=True) is None
+    # The first status recording is still ahead of the clock, so it is served early.
+    assert replay.fetch(STATUS_URL) == f'{STATUS_URL} 1500'.encode()
+    time.sleep(0.25)
+    assert replay.fetch(TRIPS_URL, conditional=True) == f'{TRIPS_URL} 3000'.encode()
+    assert replay.finished()
+    assert replay.now() == 3.0
+
+
+def test_install_routes_fetch_and_clock(recordings):
+    replay = FeedReplay(recordings, speed=None)
+    replay.install()
+    try:
+        assert fetch.fetch(TRIPS_URL) == f'{TRIPS_URL} 1000'.encode()
+        assert clock.now() == 1.0
+        with pytest.raises(requests.ConnectionError, match='feeds.test/missing'):
+            fetch.fetch('https://feeds.test/missing?key=secret')
+    finally:
+        replay.uninstall()
+    assert fetch._source is None
+
+
+def test_a_directory_without_recordings(tmp_path):
+    with pytest.raises(ValueError):
+        FeedReplay(str(tmp_path))